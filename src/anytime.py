@@ -0,0 +1,166 @@
+import sys
+import time
+import threading
+import events
+import costplan
+from executor import compile_plan
+
+# *************************************************
+# Anytime planning with a bounded planning latency.
+# - The branch and bound of costplan.py runs on a worker thread.
+#       wait() returns the best plan found within a time budget (or
+#       after a number of expansions), while the worker keeps looking
+#       for cheaper plans.
+# - execute() starts the plan at once. Before each action it takes
+#       the best plan found so far: the actions executed are
+#       committed, the worker only keeps plans that start with them,
+#       so a better plan found during the execution replaces the
+#       rest of the current one (its suffix).
+# - The worker stops when the execution ends, or with stop(). It
+#       shares the route tables of navigate.py: no other planning must
+#       run on the map meanwhile.
+# *************************************************
+
+STACK_SIZE = 256 * 1024 * 1024  # stack of the worker thread, for the recursion of long plans
+RECURSION_LIMIT = 100000  # recursion limit while the worker runs, which the stack can hold
+
+
+class AnytimeSearch(costplan.BranchAndBound):
+
+    def __init__(self, costs, limit=costplan.LIMIT, expansions=None):
+        """
+        :param expansions: number of expansions before the first plan found is ready, None to
+            wait for the end of the search (or the time budget of AnytimePlanner.wait())
+        """
+        super().__init__(costs, limit)
+        self.expansions_budget = expansions
+        self.lock = threading.Lock()
+        self.committed = []  # actions executed: the plans kept start with them
+        self.version = 0     # number of plans kept
+        self.ready = threading.Event()
+        self.halt = threading.Event()
+
+    def stopped(self):
+        if self.best and self.expansions_budget is not None and self.expansions >= self.expansions_budget:
+            self.ready.set()
+        return self.halt.is_set() or super().stopped()
+
+    def allowed(self, plan, task):
+        committed = self.committed
+        return len(plan) >= len(committed) or committed[len(plan)] == task
+
+    def found(self, plan, cost):
+        with self.lock:
+            if cost < self.best_cost and plan[:len(self.committed)] == self.committed:
+                super().found(plan, cost)
+                self.version += 1
+
+
+class AnytimePlanner:
+
+    def __init__(self, model=None, seconds=0.1, expansions=None, limit=costplan.LIMIT):
+        """
+        :param model: the simulator.TimeModel() giving the costs of the actions, or None for the default durations
+        :param seconds: time budget of wait(), None for no limit
+        :param expansions: expansion budget of wait(), None for no limit
+        :param limit: number of expansions of the whole search, in the background included
+        """
+        self.costs = costplan.Costs(model)
+        self.seconds = seconds
+        self.expansions = expansions
+        self.limit = limit
+        self.search = None
+        self.thread = None
+        self.swaps = 0  # number of suffixes swapped in during the last execution
+
+    def start(self, state, tasks):
+        """
+        Starts searching the plans of the tasks on the worker thread
+        :param state: the initial state, as for pyhop
+        :param tasks: the list of tasks
+        :return: the AnytimePlanner()
+        """
+        self.stop()
+        search = AnytimeSearch(self.costs, self.limit, self.expansions)
+        self.search = search
+
+        def work():
+            # the limit is global: put it back, unless it was changed meanwhile
+            saved = sys.getrecursionlimit()
+            limit = max(saved, RECURSION_LIMIT)
+            sys.setrecursionlimit(limit)
+            try:
+                search.seek(state, list(tasks), [], 0.0)
+            finally:
+                if sys.getrecursionlimit() == limit:
+                    sys.setrecursionlimit(saved)
+                search.ready.set()
+
+        saved = threading.stack_size(STACK_SIZE)
+        try:
+            self.thread = threading.Thread(target=work, daemon=True)
+            self.thread.start()
+        finally:
+            threading.stack_size(saved)
+        return self
+
+    def wait(self):
+        """
+        Waits for the first plan within the budget
+        :return: the best plan found so far, or False if none was found within the budget
+        """
+        self.search.ready.wait(self.seconds)
+        return self.search.best
+
+    def stop(self):
+        if self.thread is not None:
+            self.search.halt.set()
+            self.thread.join()
+            self.thread = None
+
+    def execute(self, robot, stats=None):
+        """
+        Executes the best plan found so far, swapping in the better suffixes found meanwhile,
+        stopping at the first action that fails
+        :param robot: a simulator.Robot()
+        :param stats: an executor.ExecutionStats() collecting the latency of the actions, or None
+        :return: True if all the actions succeeded, False if an action failed or there is no plan
+        """
+        search = self.search
+        with search.lock:
+            plan, version = search.best, search.version
+        if not plan:
+            self.stop()
+            return False
+        log = robot.log
+        if log is not None:
+            log.begin_plan()
+        events.publish(log, 'execute', status='start', plan=plan, pos=robot.pos)
+        steps = compile_plan(plan, robot)
+        self.swaps = 0
+        i = 0
+        try:
+            while True:
+                with search.lock:
+                    if search.version != version:
+                        plan, version = search.best, search.version
+                        steps[i:] = compile_plan(plan[i:], robot)
+                        self.swaps += 1
+                        events.publish(log, 'swap', at=i, cost=search.best_cost, plan=plan[i:])
+                    if i == len(plan):
+                        break
+                    search.committed.append(plan[i])
+                fun, args = steps[i]
+                start = time.perf_counter()
+                result = fun(*args)
+                if stats is not None:
+                    stats.add(plan[i][0], time.perf_counter() - start)
+                if result is not True:
+                    return False
+                i += 1
+            events.publish(log, 'execute', status='done', plan=plan, pos=robot.pos)
+            return True
+        finally:
+            self.stop()
+            if log is not None:
+                log.end_plan()
@@ -0,0 +1,245 @@
+from collections import deque
+
+# *************************************************
+# Assignment engine for the rearrange task: gives each variable
+#       (e.g. a room) a value (e.g. a box) from its domain.
+# - Unary constraints filter the domains up front, binary
+#       constraints between neighbors are made arc consistent
+#       (AC-3), and all-different is a global constraint.
+# - With only unary and all-different constraints the problem is
+#       a bipartite matching, solved directly (augmenting paths, or
+#       the Hungarian method to minimise a cost).
+# - Otherwise: backtracking search with MRV and degree ordering,
+#       forward checking, and branch and bound on the cost.
+# *************************************************
+
+INFINITY = float('inf')
+
+
+def ac3(domains, neighbors, constraint):
+    """
+    Makes the domains arc consistent, in place
+    :return: False if a domain became empty, else True
+    """
+    queue = deque((x, y) for x in neighbors for y in neighbors[x])
+    while queue:
+        x, y = queue.popleft()
+        removed = [a for a in domains[x] if not any(constraint(x, a, y, b) for b in domains[y])]
+        if removed:
+            for a in removed:
+                domains[x].remove(a)
+            if not domains[x]:
+                return False
+            for z in neighbors[x]:
+                if z != y:
+                    queue.append((z, x))
+    return True
+
+
+# Maximum bipartite matching by augmenting paths: returns var -> value, or None
+def match(variables, domains):
+    owner = {}     # value -> variable
+    value_of = {}  # variable -> value
+    for x in variables:
+        parent = {}  # value -> variable reaching it
+        queue = deque([x])
+        seen = set()
+        end = None
+        while queue and end is None:
+            v = queue.popleft()
+            for a in domains[v]:
+                if a in seen:
+                    continue
+                seen.add(a)
+                parent[a] = v
+                if a not in owner:
+                    end = a
+                    break
+                queue.append(owner[a])
+        if end is None:
+            return None
+        # flip the augmenting path
+        a = end
+        while a is not None:
+            v = parent[a]
+            previous = value_of.get(v)
+            owner[a] = v
+            value_of[v] = a
+            a = previous
+    return value_of
+
+
+# Minimum cost matching (Hungarian method with potentials): returns var -> value, or None
+#       if every matching uses a pair not allowed or of infinite cost (unreachable)
+def hungarian(variables, domains, cost):
+    values = sorted({a for x in variables for a in domains[x]}, key=repr)  # fixed order, for the ties
+    n, m = len(variables), len(values)
+    if n > m:
+        return None
+    big = 1.0
+    rows = []
+    for x in variables:
+        row = [INFINITY] * m
+        for j, a in enumerate(values):
+            if a in domains[x]:
+                row[j] = cost(x, a)
+                if row[j] != INFINITY:
+                    big += abs(row[j])
+        rows.append(row)
+    big *= 2  # cost standing for the pairs not allowed or of infinite cost
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)    # column -> row matched to it (1-based, 0 is none)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [INFINITY] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = rows[i0 - 1]
+            delta = INFINITY
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    c = row[j - 1]
+                    cur = (big if c == INFINITY else c) - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    result = {}
+    for j in range(1, m + 1):
+        if p[j]:
+            if rows[p[j] - 1][j - 1] == INFINITY:
+                return None
+            result[variables[p[j] - 1]] = values[j - 1]
+    return result
+
+
+class Search:
+
+    def __init__(self, variables, domains, neighbors, constraint, all_different, cost):
+        self.variables = variables
+        self.domains = domains
+        self.neighbors = neighbors
+        self.constraint = constraint
+        self.all_different = all_different
+        self.cost = cost
+        self.assignment = {}
+        self.best = None
+        self.best_cost = INFINITY
+
+    # Number of unassigned neighbors of x (all-different constrains
+    #       every variable alike, so it does not count)
+    def degree(self, x):
+        return sum(1 for y in self.neighbors.get(x, ()) if y not in self.assignment)
+
+    # Minimum remaining values, ties broken by the highest degree
+    def select(self):
+        unassigned = [x for x in self.variables if x not in self.assignment]
+        return min(unassigned, key=lambda x: (len(self.domains[x]), -self.degree(x)))
+
+    # Removes the values of the other variables inconsistent with x = a
+    def forward_check(self, x, a, removed):
+        if self.all_different:
+            for y in self.variables:
+                if y not in self.assignment and a in self.domains[y]:
+                    self.domains[y].remove(a)
+                    removed.append((y, a))
+                    if not self.domains[y]:
+                        return False
+        if self.constraint is not None:
+            for y in self.neighbors.get(x, ()):
+                if y in self.assignment:
+                    continue
+                for b in list(self.domains[y]):
+                    if not self.constraint(x, a, y, b):
+                        self.domains[y].remove(b)
+                        removed.append((y, b))
+                if not self.domains[y]:
+                    return False
+        if self.all_different:
+            # pigeonhole: enough values left for the unassigned variables
+            unassigned = [y for y in self.variables if y not in self.assignment]
+            if len(set().union(*(self.domains[y] for y in unassigned))) < len(unassigned):
+                return False
+        return True
+
+    # Lower bound of the cost of the unassigned variables
+    def bound(self):
+        if self.cost is None:
+            return 0
+        return sum(min(self.cost(x, a) for a in self.domains[x])
+                   for x in self.variables if x not in self.assignment)
+
+    def search(self, spent=0):
+        if len(self.assignment) == len(self.variables):
+            self.best = dict(self.assignment)
+            self.best_cost = spent
+            return self.cost is None
+        x = self.select()
+        values = list(self.domains[x])
+        if self.cost is not None:
+            values.sort(key=lambda a: self.cost(x, a))
+        for a in values:
+            c = spent + (self.cost(x, a) if self.cost is not None else 0)
+            saved = self.domains[x]
+            self.domains[x] = {a}
+            self.assignment[x] = a
+            removed = []
+            if self.forward_check(x, a, removed) and c + self.bound() < self.best_cost:
+                if self.search(c):
+                    return True
+            for y, b in removed:
+                self.domains[y].add(b)
+            del self.assignment[x]
+            self.domains[x] = saved
+        return False
+
+
+def solve(variables, domains, constraint=None, neighbors=None, unary=None,
+          all_different=False, cost=None):
+    """
+    Finds an assignment of the variables
+    :param variables: a list of variables
+    :param domains: a dict variable -> list of values
+    :param constraint: a function (x, a, y, b) -> True if x = a and y = b are compatible,
+        checked between neighbors
+    :param neighbors: a dict variable -> list of variables constrained with it
+    :param unary: a function (x, a) -> True if x = a is allowed
+    :param all_different: True if the variables must all have different values
+    :param cost: a function (x, a) -> cost of x = a, to find the assignment of least total cost
+    :return: a dict variable -> value, or None if there is no solution
+    """
+    domains = {x: set(a for a in domains[x] if unary is None or unary(x, a)) for x in variables}
+    if any(not domains[x] for x in variables):
+        return None
+    if neighbors is None:
+        neighbors = {}
+    if constraint is not None and not ac3(domains, neighbors, constraint):
+        return None
+    if constraint is None and all_different:
+        if cost is None:
+            return match(variables, domains)
+        return hungarian(variables, domains, cost)
+    search = Search(variables, domains, neighbors, constraint, all_different, cost)
+    search.search()
+    return search.best
@@ -0,0 +1,57 @@
+import os
+import time
+from multiprocessing import Pool
+import pyhop
+import simulator
+import navigate
+import mapfile
+
+# *************************************************
+# Batch planning of many (state, tasks) pairs on a process pool.
+# - The navigation domain registers its operators and methods when
+#       navigate is imported, that is once per worker process; the
+#       path planning engine is also set up once per worker, on a
+#       copy of the map sent with the pool initialisation, or on a
+#       binary map file (mapfile.py) whose pages the workers share.
+# - Each job is planned independently, and returned with its
+#       planning time.
+# *************************************************
+
+
+# Sets up a worker process: no GUI, and the route engine on the map
+#       (a layout, or the path of a map file) if any
+def init_worker(layout):
+    simulator.USE_GUI = False
+    if isinstance(layout, str):
+        navigate.use_map(mapfile.load(layout))
+    elif layout is not None:
+        navigate.use_map(simulator.Map(**layout))
+
+
+# Plans one job in a worker: returns the plan (or False) and the planning time
+def plan_job(job):
+    state, tasks = job
+    start = time.perf_counter()
+    plan = pyhop.pyhop(state, tasks, 0)
+    return plan, time.perf_counter() - start
+
+
+def plan_batch(jobs, simmap=None, processes=None, chunksize=None, map_path=None):
+    """
+    Plans a list of independent jobs across a pool of worker processes
+    :param jobs: a list of (state, tasks), the states built as get_state
+        or navigate.read_state build them
+    :param simmap: a simulator.Map() to plan 'navigate_to' with the path
+        planning engine, or None for the recursive navigation methods
+    :param processes: number of worker processes, all the cores by default
+    :param chunksize: number of jobs sent to a worker at once
+    :param map_path: a binary map file loaded by the workers instead of 'simmap'
+    :return: a list of (plan, seconds), in the order of the jobs
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (processes * 4))
+    layout = map_path if map_path is not None else simmap.layout() if simmap is not None else None
+    with Pool(processes, initializer=init_worker, initargs=(layout,)) as pool:
+        return pool.map(plan_job, jobs, chunksize)
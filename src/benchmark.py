@@ -0,0 +1,190 @@
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import pyhop
+import simulator
+import navigate
+from assignment import solve
+from schedule import transport_tasks
+from executor import execute
+
+# *************************************************
+# Benchmark of the planner on synthetic buildings.
+# - building() generates a building: rooms on a grid, each with its
+#       points, connected by doors between neighbouring rooms (a
+#       random spanning tree, plus extra doors with probability
+#       'density'), a fraction 'closed' of them closed, and boxes.
+# - Each scale times the planning and the headless execution (no
+#       GUI, no output, on a SimClock) of 'navigate_to', 'fetch',
+#       'transport' and 'rearrange' tasks.
+# - The results are written to a JSON file, with the commit, to
+#       compare commits.
+# *************************************************
+
+# Scales of the benchmark: the arguments of building(), None for the default map
+SCALES = {'toy': None,
+          'small': {'rooms': 10, 'points': 10, 'density': 0.3, 'closed': 0.3, 'boxes': 3},
+          'medium': {'rooms': 100, 'points': 10, 'density': 0.3, 'closed': 0.3, 'boxes': 5},
+          'large': {'rooms': 1000, 'points': 10, 'density': 0.3, 'closed': 0.3, 'boxes': 8}}
+
+TASKS = ('navigate_to', 'fetch', 'transport', 'rearrange')
+
+
+def building(rooms=3, points=3, density=0.0, closed=0.0, boxes=3, seed=0):
+    """
+    Generates a building
+    :param rooms: number of rooms
+    :param points: number of points in each room
+    :param density: probability of a door between two neighbouring rooms already connected
+    :param closed: probability that a door is closed
+    :param boxes: number of boxes, at different points
+    :param seed: seed of the random choices
+    :return: the arguments of simulator.Map(), as Map.layout() returns them
+    """
+    rng = random.Random(seed)
+    width = math.ceil(math.sqrt(rooms))
+    members = [['p%d' % (i * points + j + 1) for j in range(points)] for i in range(rooms)]
+    nodes = {p: 'room%d' % (i + 1) for i in range(rooms) for p in members[i]}
+    pairs = []
+    for i in range(rooms):
+        if (i + 1) % width and i + 1 < rooms:
+            pairs.append((i, i + 1))
+        if i + width < rooms:
+            pairs.append((i, i + width))
+    rng.shuffle(pairs)
+    parent = list(range(rooms))  # union-find of the rooms connected so far
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    doors = {}
+    for i, j in pairs:
+        a, b = find(i), find(j)
+        if a != b:
+            parent[a] = b
+        elif rng.random() >= density:
+            continue
+        status = 'closed' if rng.random() < closed else 'open'
+        doors['door%d' % (len(doors) + 1)] = [rng.choice(members[i]), rng.choice(members[j]), status]
+    spots = rng.sample(list(nodes), boxes)
+    return {'rooms': {'room%d' % (i + 1): [] for i in range(rooms)},
+            'nodes': nodes,
+            'doors': doors,
+            'boxes': {'box%d' % (k + 1): p for k, p in enumerate(spots)}}
+
+
+# Tasks of a benchmark on a map: the robot starts at the first point
+def make_tasks(simmap, task, seed=0):
+    goal = simmap.point_names[-1]
+    if task == 'navigate_to':
+        return [('navigate_to', goal)]
+    if task == 'fetch':
+        return [('fetch', 'box1')]
+    if task == 'transport':
+        return [('transport', 'box1', goal)]
+    # rearrange: each box to a different target point, assigned by route cost
+    rng = random.Random(seed)
+    start = simmap.point_names[0]
+    targets = rng.sample(simmap.point_names, len(simmap.boxes))
+    doors = {d: simmap.doors[d][2] for d in simmap.doors}
+
+    def distance(p, box):
+        d = navigate.routes.distance(simmap.boxes[box], p, doors)
+        return float('inf') if d is None else d
+
+    domains = {p: list(simmap.boxes) for p in targets}
+    assignment = solve(targets, domains, all_different=True, cost=distance)
+    jobs = [(box, p) for p, box in assignment.items()]
+    return transport_tasks(simmap, jobs, start, navigate.routes)
+
+
+# Plans and executes a task once on a new map, returns the timings
+def run_once(layout, task, hierarchical=False):
+    t0 = time.perf_counter()
+    simmap = simulator.Map() if layout is None else simulator.Map(**layout)
+    navigate.use_map(simmap, hierarchical)
+    robot = simulator.Robot('bench', simmap, simmap.point_names[0],
+                            clock=simulator.SimClock(), log=None)
+    t1 = time.perf_counter()
+    state = navigate.read_state(robot)
+    tasks = make_tasks(simmap, task)
+    plan = pyhop.pyhop(state, tasks, 0)
+    t2 = time.perf_counter()
+    result = plan is not False and execute(plan, robot)
+    t3 = time.perf_counter()
+    return {'setup': t1 - t0, 'plan': t2 - t1, 'execute': t3 - t2,
+            'length': len(plan) if plan else None, 'sim_time': robot.clock.now,
+            'success': bool(result)}
+
+
+def run(scales=tuple(SCALES), tasks=TASKS, repeat=3, hierarchical=False):
+    """
+    Runs the benchmark
+    :param scales: names of the scales in SCALES
+    :param tasks: names of the tasks in TASKS
+    :param repeat: number of runs of each task, the median is reported
+    :param hierarchical: True to plan the routes over the rooms first, as use_map() does
+    :return: a list of results, one per scale and task
+    """
+    saved = simulator.USE_GUI, simulator.DYNAMIC_WORLD
+    simulator.USE_GUI, simulator.DYNAMIC_WORLD = False, False
+    results = []
+    try:
+        for name in scales:
+            params = SCALES[name]
+            layout = None if params is None else building(**params)
+            for task in tasks:
+                runs = [run_once(layout, task, hierarchical) for i in range(repeat)]
+                result = {'scale': name, 'params': params, 'task': task,
+                          'points': len(layout['nodes']) if layout else len(simulator.NODES),
+                          'length': runs[0]['length'], 'sim_time': runs[0]['sim_time'],
+                          'success': all(r['success'] for r in runs)}
+                for key in ('setup', 'plan', 'execute'):
+                    result[key] = statistics.median(r[key] for r in runs)
+                results.append(result)
+    finally:
+        simulator.USE_GUI, simulator.DYNAMIC_WORLD = saved
+    return results
+
+
+# Returns the commit of the working tree, or None outside of git
+def commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the planner on synthetic buildings")
+    parser.add_argument('--scales', default=','.join(SCALES), help="comma-separated scales")
+    parser.add_argument('--tasks', default=','.join(TASKS), help="comma-separated tasks")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each task")
+    parser.add_argument('--hierarchical', action='store_true', help="plan the routes over the rooms first")
+    parser.add_argument('--out', default='benchmark.json', help="JSON file of the results")
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    results = run(args.scales.split(','), args.tasks.split(','), args.repeat, args.hierarchical)
+    report = {'commit': commit(), 'python': platform.python_version(), 'hierarchical': args.hierarchical,
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('{:<8}{:<13}{:>8}{:>8}{:>12}{:>12}{:>12}'.format(
+        'SCALE:', 'TASK:', 'POINTS:', 'STEPS:', 'SETUP (s):', 'PLAN (s):', 'EXEC (s):'))
+    for r in results:
+        print('{:<8}{:<13}{:>8}{:>8}{:>12.4f}{:>12.4f}{:>12.4f}'.format(
+            r['scale'], r['task'], r['points'], str(r['length']), r['setup'], r['plan'], r['execute']))
+
+
+if __name__ == '__main__':
+    main()
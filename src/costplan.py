@@ -0,0 +1,149 @@
+import copy
+import time
+import pyhop
+import simulator
+
+# *************************************************
+# Cost-optimal planning for the HTN domain.
+# - Each operator costs the duration of the robot action it stands
+#       for, from a simulator.TimeModel: the moves from the point
+#       'me' is at in the state, the other actions a fixed time.
+# - pyhop returns the first plan found; search() explores all the
+#       method alternatives depth-first, in the order of the domain,
+#       and keeps the cheapest plan (branch and bound): a branch is
+#       cut as soon as its cost reaches the best plan's. The first
+#       plan found is the one pyhop returns, so the result is never
+#       worse than pyhop's.
+# - The door statuses are in the state along the whole plan: with
+#       navigate.KEEP_DOORS_OPEN, a door opened by a task is open for
+#       the tasks after it, and use_map(..., shortcuts=True) lets the
+#       search compare a shortcut through closed doors with the
+#       cheapest route of each task.
+# - 'limit' bounds the number of expansions and 'seconds' the time of
+#       the search; the best plan found so far is returned when one of
+#       them is reached.
+# *************************************************
+
+LIMIT = 100000  # expansions of a search, by default
+
+INFINITY = float('inf')
+
+
+class Costs:
+
+    def __init__(self, model=None):
+        """
+        :param model: the simulator.TimeModel() of the robot, or None for the default durations
+        """
+        self.model = model if model is not None else simulator.TimeModel()
+
+    # Returns the cost of applying an operator in a state, 0 for actions without duration
+    def step(self, state, task):
+        name = task[0]
+        if name not in self.model.durations:
+            return 0.0
+        if name == 'moveto':
+            return self.model.duration(name, state.pos['me'], task[1])
+        if name == 'cross':
+            return self.model.duration(name, state.pos['me'], task[2])
+        return self.model.duration(name)
+
+
+def plan_cost(state, plan, costs=None):
+    """
+    Cost of a plan, without applying it
+    :param state: the state the plan starts from
+    :param plan: a list of operators
+    :param costs: a Costs(), or None for the default durations
+    :return: the total duration of the actions of the plan
+    """
+    if costs is None:
+        costs = Costs()
+    here = pyhop.State('cost')
+    here.pos = {'me': state.pos['me']}
+    total = 0.0
+    for task in plan:
+        total += costs.step(here, task)
+        if task[0] == 'moveto':
+            here.pos['me'] = task[1]
+        elif task[0] == 'cross':
+            here.pos['me'] = task[2]
+    return total
+
+
+class BranchAndBound:
+
+    def __init__(self, costs, limit=LIMIT, seconds=None):
+        self.costs = costs
+        self.limit = limit
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.best = False        # cheapest plan found so far
+        self.best_cost = INFINITY
+        self.expansions = 0
+        self.plans = 0           # number of plans found, each cheaper than the one before
+        self.complete = True     # False if the search stopped at the limit
+
+    # Returns True when the search must stop at the expansion limit or the deadline
+    def stopped(self):
+        if self.expansions >= self.limit:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    # Returns True if the operator 'task' may follow the actions of 'plan'
+    def allowed(self, plan, task):
+        return True
+
+    # Keeps a plan cheaper than the best one
+    def found(self, plan, cost):
+        self.best, self.best_cost = plan, cost
+        self.plans += 1
+
+    # Explores the decompositions of the tasks, as pyhop.seek_plan does, with the cost of the plan so far
+    def seek(self, state, tasks, plan, cost):
+        if cost >= self.best_cost:
+            return
+        if not tasks:
+            self.found(plan, cost)
+            return
+        if self.stopped():
+            self.complete = False
+            return
+        self.expansions += 1
+        task = tasks[0]
+        if task[0] in pyhop.operators and self.allowed(plan, task):
+            step = self.costs.step(state, task)
+            newstate = pyhop.operators[task[0]](copy.deepcopy(state), *task[1:])
+            if newstate:
+                self.seek(newstate, tasks[1:], plan + [task], cost + step)
+        if task[0] in pyhop.methods:
+            for method in pyhop.methods[task[0]]:
+                subtasks = method(state, *task[1:])
+                if subtasks is not False:
+                    self.seek(state, subtasks + tasks[1:], plan, cost)
+
+
+def search(state, tasks, model=None, limit=LIMIT, seconds=None):
+    """
+    Searches the cheapest plan of the tasks
+    :param state: the initial state, as for pyhop
+    :param tasks: the list of tasks
+    :param model: the simulator.TimeModel() of the robot, or None for the default durations
+    :param limit: number of expansions before returning the best plan found so far
+    :param seconds: time before returning the best plan found so far, None for no limit
+    :return: the BranchAndBound(), with the plan in 'best' (False if none) and its cost in 'best_cost'
+    """
+    bb = BranchAndBound(Costs(model), limit, seconds)
+    bb.seek(state, list(tasks), [], 0.0)
+    return bb
+
+
+def plan(state, tasks, model=None, limit=LIMIT, verbose=0, seconds=None):
+    """
+    Cost-optimal counterpart of pyhop.pyhop
+    :return: the cheapest plan found, or False if there is none
+    """
+    bb = search(state, tasks, model, limit, seconds)
+    if verbose > 0:
+        print('** costplan: cost', bb.best_cost, 'after', bb.expansions, 'expansions,',
+              bb.plans, 'plans,', 'complete' if bb.complete else 'stopped at the limit', '**')
+    return bb.best
@@ -0,0 +1,126 @@
+import pyhop
+import pathplan
+import navigate
+
+# *************************************************
+# Pickup and delivery with a robot carrying several boxes.
+# - A robot carries up to 'capacity' boxes, and at most 'max_weight'
+#       in total when the boxes have weights (1 if not given).
+# - plan_stops() orders the pickups and the deliveries of a set of
+#       jobs (box, point) by nearest neighbour over the route costs:
+#       from where the robot is, the closest of a delivery of a box it
+#       carries or a pickup of a box it has room for. Boxes close to
+#       each other are picked up together and delivered in one trip,
+#       where transport tasks take them one by one.
+# - The 'deliver' task of the domain plans the stops from the state,
+#       delivery_tasks() from a map, like schedule.transport_tasks().
+# *************************************************
+
+INFINITY = float('inf')
+
+
+def plan_stops(start, load, jobs, positions, distance, capacity=1, max_weight=None, weights=None):
+    """
+    Orders the pickups and deliveries of transport jobs for a robot carrying several boxes
+    :param start: point of the robot
+    :param load: the boxes the robot carries
+    :param jobs: a list of (box, point)
+    :param positions: dict box -> point of the boxes not carried; a box missing (e.g. carried by
+        another robot) cannot be picked up
+    :param distance: function (p, q) -> route cost from p to q, None if unreachable
+    :param capacity: number of boxes the robot can carry
+    :param max_weight: total weight the robot can carry, None for no limit
+    :param weights: dict box -> weight, 1 if not given
+    :return: a list of ('pickup', box, point) and ('putdown', box, point) stops, or
+        None if some box cannot be reached or carried
+    """
+    weights = weights or {}
+    targets = dict(jobs)
+    load = list(load)
+    waiting = [box for box, point in jobs if box not in load and positions.get(box) != point]
+    if any(box not in positions for box in waiting):
+        return None
+    weight = sum(weights.get(b, 1) for b in load)
+    here = start
+    stops = []
+
+    def cost(p):
+        d = distance(here, p)
+        return INFINITY if d is None else d
+
+    while waiting or any(b in targets for b in load):
+        candidates = [(cost(targets[b]), 0, 'putdown', b, targets[b]) for b in load if b in targets]
+        if len(load) < capacity:
+            candidates += [(cost(positions[b]), 1, 'pickup', b, positions[b]) for b in waiting
+                           if max_weight is None or weight + weights.get(b, 1) <= max_weight]
+        if not candidates:
+            return None
+        c, _, action, box, point = min(candidates)
+        if c == INFINITY:
+            return None
+        if action == 'pickup':
+            waiting.remove(box)
+            load.append(box)
+            weight += weights.get(box, 1)
+        else:
+            load.remove(box)
+            del targets[box]
+            weight -= weights.get(box, 1)
+        stops.append((action, box, point))
+        here = point
+    return stops
+
+
+# The tasks of the stops, without moving between stops at the same point
+def stop_tasks(start, stops):
+    tasks = []
+    here = start
+    for action, box, point in stops:
+        if point != here:
+            tasks.append(('navigate_to', point))
+            here = point
+        tasks.append((action, box))
+    return tasks
+
+
+# Method to deliver a set of jobs (box, point) in one tour, over the routes of navigate.use_map()
+def deliver_batch(state, jobs):
+    if navigate.routes is None:
+        return False
+    nodes = navigate.graph.nodes
+    if any(point not in nodes for box, point in jobs):
+        return False
+    positions = {box: state.pos[box] for box, point in jobs if state.pos[box] in nodes}
+    stops = plan_stops(state.pos['me'], state.load, jobs, positions,
+                       lambda p, q: navigate.routes.distance(p, q, state.doors),
+                       state.capacity, state.max_weight, state.weights)
+    if stops is None:
+        return False
+    return stop_tasks(state.pos['me'], stops)
+
+pyhop.declare_methods('deliver', deliver_batch)
+
+
+def delivery_tasks(robot, jobs, table=None):
+    """
+    Orders transport jobs into one list of tasks for a robot carrying several boxes
+    :param robot: a simulator.Robot(), giving its position, its load and its capacity
+    :param jobs: a list of (box, point)
+    :param table: the pathplan.RouteTable() to read route costs from, or None for a new one
+    :return: a list of 'navigate_to', 'pickup' and 'putdown' tasks, or None if some
+        box cannot be reached or carried
+    """
+    simmap = robot.map
+    if table is None:
+        table = pathplan.RouteTable(pathplan.RouteGraph(simmap))
+    if any(point not in simmap.nodes for box, point in jobs):
+        return None
+    doors = {d: simmap.doors[d][2] for d in simmap.doors}
+    positions = {box: simmap.boxes[box] for box, point in jobs
+                 if box not in robot.load and simmap.boxes[box] in simmap.nodes}
+    stops = plan_stops(robot.pos, robot.load, jobs, positions,
+                       lambda p, q: table.distance(p, q, doors),
+                       robot.capacity, robot.max_weight, simmap.weights)
+    if stops is None:
+        return None
+    return stop_tasks(robot.pos, stops)
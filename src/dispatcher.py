@@ -0,0 +1,469 @@
+import sys
+import json
+import math
+import heapq
+import random
+import asyncio
+import argparse
+import statistics
+import pyhop
+import simulator
+import navigate
+from fleet import Fleet
+from benchmark import SCALES, building
+
+# *************************************************
+# Dispatcher of a fleet: a queue of jobs served by the robots.
+# - A job is a 'navigate_to', 'fetch' or 'transport' task, with a
+#       priority and an arrival time. The jobs wait in a priority
+#       queue: the highest priority first, then the first arrived.
+# - When a robot is idle and jobs wait, the first job goes to the
+#       idle robot with the lowest estimated route cost to it (to the
+#       goal point or to the box), from the route tables of
+#       navigate.use_map(). The robot plans the job from its own
+#       state and executes the plan on the fleet.Fleet runtime. Idle
+#       robots move off the door points, not to block the others; when
+#       the robots block each other, the job of the robot preempted by
+#       the fleet goes back to the queue, and the robot yields: it
+#       moves out of the way (out of its room if the room is full) and
+#       backs off for a while, so the other robot goes on and the job
+#       may go to another robot. A job preempted too often fails.
+# - Time is the simulated time of the fleet. The report gives the
+#       queue depth, the latency of the jobs (from arrival to end)
+#       and the jobs completed per simulated hour.
+# - Jobs are submitted in-process (submit(), run()) or as JSON lines
+#       over a socket (serve()); load_test() runs Poisson arrivals
+#       at several rates against several fleet sizes.
+# *************************************************
+
+TASKS = ('navigate_to', 'fetch', 'transport')
+ARGUMENTS = {'navigate_to': ('point',), 'fetch': ('box',), 'transport': ('box', 'point')}  # of the tasks
+
+BACKOFF = 5.0       # simulated seconds a preempted robot waits before taking another job
+MAX_PREEMPTIONS = 10  # preemptions of a job before it fails
+CHECK_RATIO = 0.8     # share of the jobs check() expects completed in each run
+
+INFINITY = float('inf')
+
+
+class Job:
+    __slots__ = ('id', 'task', 'priority', 'arrival', 'robot', 'start', 'end', 'status', 'preemptions')
+
+    def __init__(self, id, task, priority, arrival):
+        self.id = id
+        self.task = task
+        self.priority = priority
+        self.arrival = arrival  # simulated time the job enters the queue
+        self.robot = None       # robot assigned to the job
+        self.start = None       # simulated time the robot starts it
+        self.end = None         # simulated time it is completed or failed
+        self.status = 'waiting'  # then 'assigned', 'completed', 'failed' or 'no plan'
+        self.preemptions = 0     # times its robot was preempted
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Dispatcher:
+
+    def __init__(self, fleet):
+        """
+        :param fleet: the fleet.Fleet() of the robots, on a map given to navigate.use_map(),
+            preemptive to recover from deadlocks
+        """
+        self.fleet = fleet
+        self.jobs = []       # Job(), by id
+        self.arrivals = []   # heap of (arrival, id) of the jobs not yet in the queue
+        self.queue = []      # heap of (-priority, arrival, id) of the jobs waiting
+        self.idle = {}       # robot name -> future resolved when it gets a job
+        self.assigned = {}   # robot name -> Job() given to it
+        self.depths = [(0.0, 0)]  # (time, queue depth) at each change
+        self.preempted = 0   # jobs preempted to break a deadlock of the robots
+        self.moving = set()  # idle robots woken to move out of the way
+        fleet.scheduler.unblock = self.unblock
+
+    def submit(self, task, priority=0, at=None):
+        """
+        Adds a job
+        :param task: a 'navigate_to', 'fetch' or 'transport' task, in the HTN format
+        :param priority: jobs of higher priority are served first
+        :param at: simulated time of the arrival of the job, None for now
+        :return: the id of the job
+        """
+        task = tuple(task)
+        if not task or task[0] not in TASKS:
+            raise ValueError("unknown task " + repr(task))
+        kinds = ARGUMENTS[task[0]]
+        if len(task) != len(kinds) + 1:
+            raise ValueError("task " + repr(task) + " takes " + ', '.join(kinds))
+        simmap = self.fleet.map
+        for kind, a in zip(kinds, task[1:]):
+            if kind == 'point' and a not in simmap.nodes or kind == 'box' and a not in simmap.boxes:
+                raise ValueError("unknown " + kind + " " + repr(a) + " in task " + repr(task))
+        now = self.fleet.scheduler.now
+        job = Job(len(self.jobs), task, priority, now if at is None else max(at, now))
+        self.jobs.append(job)
+        heapq.heappush(self.arrivals, (job.arrival, job.id))
+        return job.id
+
+    # Point a robot must reach first for a task
+    def target(self, task):
+        if task[0] == 'navigate_to':
+            return task[1]
+        return self.fleet.map.boxes.get(task[1])
+
+    # Estimated route cost of a job for a robot, with the doors as they are
+    def cost(self, robot, job, doors):
+        p = self.target(job.task)
+        d = navigate.routes.distance(robot.pos, p, doors)
+        return INFINITY if d is None else d
+
+    def record_depth(self):
+        self.depths.append((self.fleet.scheduler.now, len(self.queue)))
+
+    # Gives the first jobs of the queue to the idle robots, the cheapest robot for each job.
+    #       A job on a box waits while another job on the box runs; on a box carried by
+    #       a robot, it goes to that robot, when it is idle; else to a robot with room for it.
+    def dispatch(self):
+        held = []
+        busy = {job.task[1] for job in self.assigned.values() if job.task[0] != 'navigate_to'}
+        doors = {d: self.fleet.map.doors[d][2] for d in self.fleet.map.doors}
+        while self.queue and self.idle:
+            entry = heapq.heappop(self.queue)
+            job = self.jobs[entry[2]]
+            p = self.target(job.task)
+            if job.task[0] != 'navigate_to' and job.task[1] in busy:
+                held.append(entry)
+                continue
+            if p in self.fleet.robots:
+                if p not in self.idle:
+                    held.append(entry)
+                    continue
+                robot = self.fleet.robots[p]
+            else:
+                robots = [self.fleet.robots[name] for name in self.idle]
+                if job.task[0] != 'navigate_to':
+                    robots = [r for r in robots if r.fits(job.task[1])]
+                if not robots:
+                    held.append(entry)
+                    continue
+                robot = min(robots, key=lambda r: self.cost(r, job, doors))
+            job.robot = robot.name
+            job.status = 'assigned'
+            self.assigned[robot.name] = job
+            if job.task[0] != 'navigate_to':
+                busy.add(job.task[1])
+            self.fleet.scheduler.wake(self.idle.pop(robot.name))
+        for entry in held:
+            heapq.heappush(self.queue, entry)
+        self.record_depth()
+
+    # Moves the jobs arrived to the queue, at their arrival time
+    async def feed(self):
+        sched = self.fleet.scheduler
+        while self.arrivals:
+            arrival, k = self.arrivals[0]
+            if arrival > sched.now:
+                await sched.sleep(arrival - sched.now)
+            heapq.heappop(self.arrivals)
+            job = self.jobs[k]
+            heapq.heappush(self.queue, (-job.priority, job.arrival, k))
+            self.dispatch()
+
+    # Moves an idle robot off a door point, where it would block the routes of the others,
+    #       to a free point of its room; with 'away', off any point a robot waits for, to
+    #       the closest free point of the map when its room has none
+    async def park(self, robot, away=False):
+        simmap = self.fleet.map
+        if not away and not simmap.doors_of(robot.pos):
+            return
+        boxes = set(simmap.boxes.values())
+        free = [p for p in simmap.points_of(simmap.nodes[robot.pos]) if self.free(p)]
+        spots = [p for p in free if not simmap.doors_of(p) and p not in boxes]
+        if spots or away and free:
+            await self.fleet.step(robot, ('moveto', (spots or free)[0]), None)
+            return
+        if not away:
+            return
+        p = self.escape(robot)
+        if p is None:
+            doors = {d: simmap.doors[d][2] for d in simmap.doors}
+            spots = [(navigate.routes.distance(robot.pos, q, doors), q) for q in simmap.nodes
+                     if self.free(q) and not simmap.doors_of(q) and q not in boxes]
+            spots = [(d, q) for d, q in spots if d is not None]
+            if not spots:
+                return
+            p = min(spots)[1]
+        plan = pyhop.pyhop(navigate.read_state(robot), [('navigate_to', p)], 0)
+        if plan:
+            await self.fleet.execute_plan(robot, plan)
+
+    # Returns True if no robot stands on point p or waits for it
+    def free(self, p):
+        sched = self.fleet.scheduler
+        return ('point', p) not in sched.owners and not sched.waiters.get(('point', p))
+
+    # Returns a free point next to a robot (in its room, or behind a door it stands at,
+    #       which no other robot holds), None if it is hemmed in
+    def escape(self, robot):
+        simmap = self.fleet.map
+        owners = self.fleet.scheduler.owners
+        for p in simmap.points_of(simmap.nodes[robot.pos]):
+            if p != robot.pos and self.free(p):
+                return p
+        for d in simmap.doors_of(robot.pos):
+            p, q = simmap.doors[d][0], simmap.doors[d][1]
+            p = q if p == robot.pos else p
+            if self.free(p) and owners.get(('door', d), robot.name) == robot.name:
+                return p
+        return None
+
+    # Called by the fleet's scheduler when all the robots wait: an idle robot standing where
+    #       another one waits to go moves away if it can, else the scheduler preempts a
+    #       robot, one which can step aside if any (of the wait cycle first)
+    def unblock(self):
+        sched = self.fleet.scheduler
+        for resource, queue in sched.waiters.items():
+            holder = sched.owners.get(resource)
+            if queue and holder in self.idle and self.escape(self.fleet.robots[holder]):
+                self.moving.add(holder)
+                sched.wake(self.idle.pop(holder))
+                return True
+        if not sched.preemptive:
+            return False
+        waits = sched.waits()
+        for group in (sched.cycle(waits), list(waits)):
+            free = [o for o in group if o in self.fleet.robots and self.escape(self.fleet.robots[o])]
+            if free:
+                return sched.preempt(max(free, key=lambda o: waits[o][1][2]))
+        return sched.preempt()
+
+    # Serves the jobs given to a robot
+    async def work(self, robot):
+        sched = self.fleet.scheduler
+        while True:
+            await self.park(robot)
+            fut = asyncio.get_running_loop().create_future()
+            self.idle[robot.name] = fut
+            self.dispatch()
+            await sched.block(fut)
+            if robot.name in self.moving:
+                self.moving.discard(robot.name)
+                await self.park(robot, away=True)
+                continue
+            job = self.assigned[robot.name]
+            job.start = sched.now
+            plan = pyhop.pyhop(navigate.read_state(robot), [job.task], 0)
+            result = False if plan is False else await self.fleet.execute_plan(robot, plan)
+            del self.assigned[robot.name]
+            if result is None:
+                # preempted in a deadlock: the job goes back to the queue, the robot yields
+                self.preempted += 1
+                job.preemptions += 1
+                job.robot = None
+                if job.preemptions < MAX_PREEMPTIONS:
+                    job.status = 'waiting'
+                    heapq.heappush(self.queue, (-job.priority, job.arrival, job.id))
+                    self.dispatch()
+                else:
+                    job.status = 'failed'
+                    job.end = sched.now
+                await self.park(robot, away=True)
+                await sched.sleep(BACKOFF)
+                continue
+            job.status = 'completed' if result else 'failed' if plan else 'no plan'
+            job.end = sched.now
+
+    async def run_async(self):
+        """
+        Serves the jobs submitted until they are all done, as run() does, on the running event loop
+        """
+        self.idle = {}
+        coros = [self.feed()] + [self.work(robot) for robot in self.fleet.robots.values()]
+        await self.fleet.scheduler.run(coros)
+        self.idle = {}
+        return self.report()
+
+    def run(self):
+        """
+        Serves the jobs submitted until they are all done, or the robots are deadlocked
+        :return: the report()
+        """
+        return asyncio.run(self.run_async())
+
+    def report(self):
+        """
+        :return: a dict: the number of jobs by status, the deadlocked robots, the simulated
+            time, the queue depth (highest and time-averaged), the latency of the completed
+            jobs (mean, median, 95th percentile, highest) and the completed jobs per simulated hour
+        """
+        now = self.fleet.scheduler.now
+        done = [job for job in self.jobs if job.status == 'completed']
+        latencies = sorted(job.end - job.arrival for job in done)
+        area = 0.0
+        for (t1, depth), (t2, _) in zip(self.depths, self.depths[1:] + [(now, 0)]):
+            area += depth * (t2 - t1)
+        report = {'jobs': len(self.jobs),
+                  'deadlocked': sorted(self.assigned),
+                  'preempted': self.preempted}
+        for status in ('completed', 'failed', 'no plan', 'waiting'):
+            report[status] = sum(1 for job in self.jobs if job.status == status)
+        report.update({'time': now,
+                       'max_depth': max(depth for t, depth in self.depths),
+                       'mean_depth': area / now if now > 0 else 0.0,
+                       'mean_latency': statistics.mean(latencies) if latencies else None,
+                       'median_latency': statistics.median(latencies) if latencies else None,
+                       'p95_latency': latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else None,
+                       'max_latency': latencies[-1] if latencies else None,
+                       'throughput': len(done) * 3600.0 / now if now > 0 else 0.0})
+        return report
+
+
+# Answers one request of the socket API, a dict decoded from a JSON line
+async def handle(dispatcher, request):
+    op = request.get('op')
+    if op == 'submit':
+        return {'id': dispatcher.submit(request['task'], request.get('priority', 0), request.get('at'))}
+    if op == 'run':
+        return await dispatcher.run_async()
+    if op == 'report':
+        return dispatcher.report()
+    if op == 'jobs':
+        return [job.to_dict() for job in dispatcher.jobs]
+    raise ValueError("unknown op " + repr(op))
+
+
+async def serve(dispatcher, host='127.0.0.1', port=8765):
+    """
+    Serves the dispatcher over a socket, one JSON request per line, one JSON answer per line:
+    {"op": "submit", "task": ["transport", "box1", "p9"], "priority": 0, "at": 0.0} -> {"id": 0},
+    {"op": "run"} -> the report, once the jobs submitted are done,
+    {"op": "report"} -> the report, {"op": "jobs"} -> the jobs
+    """
+    async def client(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                answer = await handle(dispatcher, json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                answer = {'error': str(e)}
+            writer.write((json.dumps(answer) + '\n').encode('utf-8'))
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+# Jobs arriving as a Poisson process: 'rate' jobs per simulated hour
+def random_jobs(simmap, count, rate, seed=0):
+    rng = random.Random(seed)
+    points = list(simmap.nodes)
+    boxes = sorted(simmap.boxes)
+    t = 0.0
+    jobs = []
+    for k in range(count):
+        t += rng.expovariate(rate / 3600.0)
+        if boxes and rng.random() < 0.5:
+            task = ('transport', rng.choice(boxes), rng.choice(points))
+        else:
+            task = ('navigate_to', rng.choice(points))
+        jobs.append((task, rng.randint(0, 2), t))
+    return jobs
+
+
+def make_dispatcher(layout, robots, model=None, seed=0):
+    """
+    Builds a fleet of robots on a new map, and its dispatcher
+    :param layout: the arguments of simulator.Map(), None for the default map
+    :param robots: number of robots, at different points
+    :param model: the simulator.TimeModel() of the robots
+    :return: the Dispatcher()
+    """
+    simmap = simulator.Map() if layout is None else simulator.Map(**layout)
+    navigate.use_map(simmap)
+    fleet = Fleet(simmap, preemptive=True)
+    starts = random.Random(seed).sample(list(simmap.nodes), robots)
+    for k, p in enumerate(starts):
+        fleet.add_robot('robot%d' % (k + 1), p, model)
+    return Dispatcher(fleet)
+
+
+def load_test(layout, fleet_sizes, rates, count=50, seed=0):
+    """
+    Runs the same kind of job stream at several arrival rates against several fleet sizes
+    :param layout: the arguments of simulator.Map(), None for the default map
+    :param fleet_sizes: numbers of robots
+    :param rates: arrival rates, in jobs per simulated hour
+    :param count: number of jobs of each run
+    :return: a list of reports, with the fleet size and the rate
+    """
+    saved = simulator.USE_GUI, simulator.DYNAMIC_WORLD
+    simulator.USE_GUI, simulator.DYNAMIC_WORLD = False, False
+    results = []
+    try:
+        for robots in fleet_sizes:
+            for rate in rates:
+                dispatcher = make_dispatcher(layout, robots, seed=seed)
+                for task, priority, at in random_jobs(dispatcher.fleet.map, count, rate, seed):
+                    dispatcher.submit(task, priority, at)
+                report = dispatcher.run()
+                report.update({'robots': robots, 'rate': rate})
+                results.append(report)
+    finally:
+        simulator.USE_GUI, simulator.DYNAMIC_WORLD = saved
+    return results
+
+
+def check(fleet_sizes=(1, 2, 3), rates=(60.0,), count=30, seeds=(0, 1, 2)):
+    """
+    Load test on the default map, where the robots crowd the rooms and block each other
+    :return: the reports of the runs completing fewer than CHECK_RATIO of their jobs
+    """
+    poor = []
+    for seed in seeds:
+        for report in load_test(None, fleet_sizes, rates, count, seed):
+            report['seed'] = seed
+            if report['completed'] < CHECK_RATIO * report['jobs']:
+                poor.append(report)
+    return poor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the dispatcher of a fleet")
+    parser.add_argument('--scale', default='small', help="scale of the building, as in benchmark.py")
+    parser.add_argument('--robots', default='1,2,4', help="comma-separated fleet sizes")
+    parser.add_argument('--rates', default='30,60,120', help="comma-separated arrival rates, in jobs per hour")
+    parser.add_argument('--jobs', type=int, default=50, help="jobs of each run")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the robots' starts and of the jobs")
+    parser.add_argument('--serve', type=int, default=None, help="serve the dispatcher of the first fleet size on this port instead")
+    parser.add_argument('--check', action='store_true', help="check that most jobs complete on the default map instead")
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    if args.check:
+        poor = check()
+        for r in poor:
+            print('robots', r['robots'], 'seed', r['seed'], ':', r['completed'], 'of', r['jobs'], 'jobs completed')
+        print('check', 'failed' if poor else 'passed')
+        sys.exit(1 if poor else 0)
+    params = SCALES[args.scale]
+    layout = None if params is None else building(**params, seed=args.seed)
+    sizes = [int(n) for n in args.robots.split(',')]
+    if args.serve is not None:
+        simulator.USE_GUI = False
+        asyncio.run(serve(make_dispatcher(layout, sizes[0], seed=args.seed), port=args.serve))
+        return
+    results = load_test(layout, sizes, [float(r) for r in args.rates.split(',')], args.jobs, args.seed)
+    print('{:<8}{:>8}{:>11}{:>9}{:>11}{:>11}{:>13}{:>13}'.format(
+        'ROBOTS:', 'RATE:', 'COMPLETED:', 'FAILED:', 'MAX DEPTH:', 'MEAN DEPTH:', 'LATENCY (s):', 'JOBS/HOUR:'))
+    for r in results:
+        print('{:<8}{:>8.0f}{:>11}{:>9}{:>11}{:>11.2f}{:>13}{:>13.1f}'.format(
+            r['robots'], r['rate'], r['completed'], r['failed'] + r['no plan'], r['max_depth'], r['mean_depth'],
+            '-' if r['mean_latency'] is None else '%.1f' % r['mean_latency'], r['throughput']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import json
+import time
+from collections import deque
+from collections.abc import Mapping, MutableSequence
+
+# *************************************************
+# Structured event stream of planning and execution.
+# - Events are dicts with a 'kind' ('action', 'reshuffle',
+#       'execute', 'task', 'repair', 'state', 'map', ...), the fields
+#       of the event, the wall-clock time ('wall') and the id of the
+#       plan being executed ('plan_id').
+# - Subscribers are functions called with each event: the console
+#       (which writes the usual messages), ring buffers, JSONL files.
+# - A stream without subscribers is disabled: publishers check
+#       'enabled' before building their events, so they cost nothing.
+# *************************************************
+
+
+class EventStream:
+
+    def __init__(self, *subscribers):
+        self.subscribers = list(subscribers)
+        self.plan_id = None  # id of the plan being executed
+        self.plans = 0       # number of plans started
+
+    @property
+    def enabled(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    # Gives a new plan id to the events that follow
+    def begin_plan(self):
+        self.plans += 1
+        self.plan_id = self.plans
+        return self.plan_id
+
+    def end_plan(self):
+        self.plan_id = None
+
+    def publish(self, kind, **fields):
+        if not self.subscribers:
+            return
+        fields['kind'] = kind
+        fields['wall'] = time.time()
+        fields['plan_id'] = self.plan_id
+        for subscriber in self.subscribers:
+            subscriber(fields)
+
+
+class RingBuffer:
+
+    # Keeps the last 'capacity' events in memory
+    def __init__(self, capacity=10000):
+        self.events = deque(maxlen=capacity)
+
+    def __call__(self, event):
+        self.events.append(event)
+
+
+class JsonlSink:
+
+    # Writes the events to a file, one JSON object per line, through a write buffer
+    def __init__(self, path, buffering=1 << 16):
+        self.file = open(path, 'w', buffering=buffering)
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event, default=str))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+# Messages of the robot actions, as written on the console
+MESSAGES = {'moveto': "Moving from {from} to {to}",
+            'cross': "Crossing {door} from {from} to {to}",
+            'open': "Opening {door}",
+            'close': "Closing {door}",
+            'pickup': "Picking up {box}",
+            'putdown': "Putting down {box}"}
+FAILURES = {'moveto': "Cannot move from {from} to {to}",
+            'cross': "Cannot cross {door} from {from} to {to}",
+            'pickup': "Cannot pick up {box}",
+            'putdown': "Cannot put down {box}"}
+OUTCOMES = {'completed': "Execution completed!",
+            'failed': "Execution failed!",
+            'no plan': "No plan found!"}
+
+
+# Writes an event on the console, as the simulator always did
+def console(event):
+    kind = event['kind']
+    if kind == 'action':
+        if event['status'] == 'start':
+            print(MESSAGES[event['action']].format(**event), end='')
+        elif event['status'] == 'done':
+            print(" done")
+        else:
+            print(FAILURES[event['action']].format(**event))
+    elif kind == 'progress':
+        print('.', end='', flush=True)
+    elif kind == 'reshuffle':
+        print("* Reshuffling:", event['box'], "moved from", event['from'], "to", event['to'])
+    elif kind == 'execute':
+        if event['status'] == 'start':
+            print("Executing plan", event['plan'])
+            print("Robot's initial location:", event['pos'])
+        else:
+            print("Robot's final location:", event['pos'])
+    elif kind == 'task':
+        print(OUTCOMES[event['status']])
+    elif kind == 'swap':
+        print("Better plan found, executing", event['plan'], "from action", event['at'])
+    elif kind == 'segment':
+        print("Executing plan", event['plan'], "for", event['task'])
+    elif kind == 'repair':
+        if event['status'] == 'diverged':
+            print("World diverged at", event['action'], "- repairing", event['task'])
+        else:
+            print("Repair budget exhausted!")
+    elif kind == 'state':
+        print("Initial state updated:")
+        for name, value in event['values'].items():
+            print('    ' + event['name'] + '.' + name + ' =', value)
+    elif kind == 'robot':
+        print('-'.__mul__(30))
+        print("ROBOT:", event['robot'], "at", event['pos'], "carrying", event['carry'])
+        print('-'.__mul__(30))
+    elif kind == 'map':
+        print('-'.__mul__(30))
+        print('{:<10}{}'.format('ROOM:', 'POINTS:'))
+        for r, ps in event['rooms'].items():
+            print('{:<10}'.format(r) + ', '.join(ps))
+        print('-'.__mul__(30))
+        print('{:<10}{}'.format('DOOR:', 'STATUS:'))
+        for d, status in event['doors'].items():
+            print('{:<10}'.format(d) + status)
+        print('-'.__mul__(30))
+        print('{:<10}{}'.format('BOX:', 'LOCATION:'))
+        for b, p in event['boxes'].items():
+            print('{:<10}'.format(b) + p)
+        print('-'.__mul__(30))
+    elif kind == 'message':
+        print(event['text'])
+
+
+# Publishes an event on a stream that may be None
+def publish(log, kind, **fields):
+    if log is not None and log.enabled:
+        log.publish(kind, **fields)
+
+
+# Copies a value into plain dicts and lists, to publish it
+def plain(value):
+    if isinstance(value, Mapping):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, MutableSequence)):
+        return [plain(v) for v in value]
+    return value
+
+
+# Stream used by default, written on the console
+default = EventStream(console)
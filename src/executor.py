@@ -0,0 +1,81 @@
+import time
+import events
+
+# *************************************************
+# Execution of plans on a simulator.Robot.
+# - The actions of a plan are resolved once to the bound methods
+#       of the robot, and the plan is checked before it starts.
+# - ExecutionStats collects the wall-clock latency of each action.
+# *************************************************
+
+# Number of arguments of each action the robot can execute
+ACTIONS = {'moveto': 1, 'cross': 2, 'open': 1, 'close': 1, 'pickup': 1, 'putdown': 1}
+
+
+def compile_plan(plan, robot):
+    """
+    Resolves the actions of a plan to the methods of a robot
+    :param plan: a list of actions, as returned by pyhop
+    :param robot: a simulator.Robot()
+    :return: a list of (method, arguments), one per action
+    """
+    table = {name: getattr(robot, name) for name in ACTIONS}
+    steps = []
+    for act in plan:
+        if act[0] not in table:
+            raise ValueError("unknown action " + repr(act))
+        if len(act) - 1 != ACTIONS[act[0]]:
+            raise ValueError("wrong number of arguments in " + repr(act))
+        steps.append((table[act[0]], act[1:]))
+    return steps
+
+
+class ExecutionStats:
+
+    def __init__(self):
+        self.count = {}  # action -> number of executions
+        self.total = {}  # action -> total latency in seconds
+        self.max = {}    # action -> highest latency in seconds
+
+    def add(self, action, seconds):
+        self.count[action] = self.count.get(action, 0) + 1
+        self.total[action] = self.total.get(action, 0.0) + seconds
+        self.max[action] = max(self.max.get(action, 0.0), seconds)
+
+    # Prints the latency of each action
+    def print(self):
+        print('-'.__mul__(46))
+        print('{:<10}{:>8}{:>14}{:>14}'.format('ACTION:', 'COUNT:', 'MEAN (ms):', 'MAX (ms):'))
+        for a in sorted(self.total, key=self.total.get, reverse=True):
+            print('{:<10}{:>8}{:>14.3f}{:>14.3f}'.format(
+                a, self.count[a], 1000 * self.total[a] / self.count[a], 1000 * self.max[a]))
+        print('-'.__mul__(46))
+
+
+def execute(plan, robot, stats=None):
+    """
+    Executes a plan, stopping at the first action that fails
+    :param plan: a list of actions, as returned by pyhop
+    :param robot: a simulator.Robot()
+    :param stats: an ExecutionStats() collecting the latency of the actions, or None
+    :return: True if all the actions succeeded, or False
+    """
+    log = robot.log
+    if log is not None:
+        log.begin_plan()
+    events.publish(log, 'execute', status='start', plan=plan, pos=robot.pos)
+    steps = compile_plan(plan, robot)
+    clock = time.perf_counter
+    try:
+        for act, (fun, args) in zip(plan, steps):
+            start = clock()
+            result = fun(*args)
+            if stats is not None:
+                stats.add(act[0], clock() - start)
+            if result is not True:
+                return False
+        events.publish(log, 'execute', status='done', plan=plan, pos=robot.pos)
+        return True
+    finally:
+        if log is not None:
+            log.end_plan()
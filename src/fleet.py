@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+from collections import deque
+import simulator
+
+# *************************************************
+# Multi-robot runtime: several robots execute their plans at
+#       the same time on an asyncio event loop, on one shared map.
+# - Time is simulated: an action of a robot lasts the duration
+#       given by the time model of its SimClock, and the
+#       Scheduler advances the time when every robot is waiting.
+# - Points and doors are resources: a robot holds the point where
+#       it stands and the point it is moving to, and holds a door
+#       from the first to the last of its consecutive actions on it.
+# - A robot claims the boxes its plan picks up: a plan which needs
+#       a box claimed or carried by another robot is reported as a
+#       conflict, and fails.
+# - When all the robots wait for each other, the run ends with them
+#       deadlocked; a preemptive Scheduler instead breaks the deadlock
+#       by stopping the plan of the robot which waited last.
+# *************************************************
+
+
+class Preempted(Exception):
+    pass
+
+
+class Scheduler:
+
+    def __init__(self, preemptive=False):
+        """
+        :param preemptive: True to break the deadlocks by raising Preempted in the
+            coroutine which waited last for a resource
+        """
+        self.now = 0.0
+        self.timers = []    # heap of (time, sequence number, future)
+        self.seq = 0
+        self.running = 0    # coroutines which are not waiting
+        self.owners = {}    # resource -> owner
+        self.waiters = {}   # resource -> deque of (owner, future, sequence number)
+        self.preemptive = preemptive
+        self.preemptions = 0
+
+    # Blocks the current coroutine until a future is resolved by the scheduler
+    async def block(self, fut):
+        self.running -= 1
+        await fut
+
+    # Resolves a future blocking a coroutine
+    def wake(self, fut):
+        self.running += 1
+        fut.set_result(None)
+
+    # Waits for 'delay' seconds of simulated time
+    async def sleep(self, delay):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.timers, (self.now + delay, self.seq, fut))
+        self.seq += 1
+        await self.block(fut)
+
+    # Waits until the resource is free, and takes it for owner
+    async def acquire(self, resource, owner):
+        holder = self.owners.get(resource)
+        if holder is None or holder == owner:
+            self.owners[resource] = owner
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(resource, deque()).append((owner, fut, self.seq))
+        self.seq += 1
+        await self.block(fut)
+
+    # Gives the resource to the next owner waiting for it, if any
+    def release(self, resource, owner):
+        if self.owners.get(resource) != owner:
+            return
+        queue = self.waiters.get(resource)
+        if queue:
+            nxt, fut, _ = queue.popleft()
+            self.owners[resource] = nxt
+            self.wake(fut)
+        else:
+            del self.owners[resource]
+
+    # Returns the waits of the coroutines: owner -> (resource, entry) it waits for
+    def waits(self):
+        waits = {}
+        for resource, queue in self.waiters.items():
+            for entry in queue:
+                waits[entry[0]] = (resource, entry)
+        return waits
+
+    # Returns the owners waiting for each other in a cycle, [] if none
+    def cycle(self, waits):
+        for owner in waits:
+            path = []
+            while owner in waits and owner not in path:
+                path.append(owner)
+                owner = self.owners.get(waits[owner][0])
+            if owner in path:
+                return path[path.index(owner):]
+        return []
+
+    # Raises Preempted in a coroutine waiting for a resource: 'owner' if given, else
+    #       the one which waited last among those waiting for each other in a cycle,
+    #       if any. Returns False if none waits.
+    def preempt(self, owner=None):
+        waits = self.waits()
+        if not waits:
+            return False
+        if owner is None:
+            candidates = [waits[o] for o in self.cycle(waits) or waits]
+            resource, entry = max(candidates, key=lambda c: c[1][2])
+        else:
+            resource, entry = waits[owner]
+        self.waiters[resource].remove(entry)
+        self.running += 1
+        entry[1].set_exception(Preempted())
+        self.preemptions += 1
+        return True
+
+    # Called when all the coroutines wait for resources, returns True if it woke one.
+    #       An owner of the coroutines (e.g. a dispatcher) may replace it.
+    def unblock(self):
+        return self.preemptive and self.preempt()
+
+    async def run(self, coros):
+        """
+        Runs coroutines until they are all done, or all waiting for resources
+        :param coros: the coroutines, which wait only with sleep and acquire
+        :return: the indices of the coroutines that were deadlocked (and cancelled)
+        """
+        tasks = [asyncio.ensure_future(c) for c in coros]
+        self.running += len(tasks)
+        for t in tasks:
+            t.add_done_callback(self.task_done)
+        stalls = 0  # preemptions since the time last advanced
+        while True:
+            while self.running > 0:
+                await asyncio.sleep(0)
+            if not self.timers:
+                if stalls <= len(self.owners) and self.unblock():
+                    stalls += 1
+                    continue
+                break
+            stalls = 0
+            t, _, fut = heapq.heappop(self.timers)
+            self.now = t
+            self.wake(fut)
+        deadlocked = [i for i, t in enumerate(tasks) if not t.done()]
+        for i in deadlocked:
+            tasks[i].cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+        return deadlocked
+
+    def task_done(self, task):
+        if not task.cancelled():
+            self.running -= 1
+
+
+# Returns the door an action is about, or None
+def door_of(act):
+    if act[0] in ('open', 'close', 'cross'):
+        return act[1]
+    return None
+
+
+class Fleet:
+
+    def __init__(self, simmap, log=None, preemptive=False):
+        """
+        :param simmap: the simulator.Map() shared by the robots
+        :param log: the events.EventStream() of the robots, None to run silently
+        :param preemptive: True to break the deadlocks, as Scheduler() does
+        """
+        self.map = simmap
+        self.log = log
+        self.scheduler = Scheduler(preemptive)
+        self.robots = {}
+        self.completed = []  # (robot, time) of each plan completed
+        self.failed = []     # (robot, action) of each plan failed
+        self.conflicts = []  # (time, robot, box, holder) of each box conflict
+        self.claims = {}     # box -> robot whose plan picks it up
+
+    def add_robot(self, name, start, model=None):
+        """
+        Adds a robot to the fleet
+        :param name: name of the robot
+        :param start: starting point, which must not be taken by another robot
+        :param model: the simulator.TimeModel() of its actions
+        :return: the simulator.Robot()
+        """
+        if self.scheduler.owners.get(('point', start)) is not None:
+            raise ValueError("point " + start + " is already taken")
+        robot = simulator.Robot(name, self.map, start, clock=simulator.SimClock(model), log=self.log)
+        self.robots[name] = robot
+        self.scheduler.owners[('point', start)] = name
+        return robot
+
+    # Executes one action of a plan, waiting for the resources and the time it needs
+    async def step(self, robot, act, nxt):
+        sched = self.scheduler
+        d = door_of(act)
+        if d is not None:
+            await sched.acquire(('door', d), robot.name)
+        if act[0] in ('moveto', 'cross'):
+            await sched.acquire(('point', act[-1]), robot.name)
+        if act[0] == 'pickup':
+            holder = self.map.boxes.get(act[1])
+            if holder in self.robots and holder != robot.name:
+                self.conflicts.append((sched.now, robot.name, act[1], holder))
+                return False
+        robot.clock.now = sched.now
+        old = robot.pos
+        result = getattr(robot, act[0])(*act[1:])
+        await sched.sleep(robot.clock.now - sched.now)
+        if act[0] in ('moveto', 'cross'):
+            sched.release(('point', old if result is True else act[-1]), robot.name)
+        if d is not None and (nxt is None or door_of(nxt) != d):
+            sched.release(('door', d), robot.name)
+        return result is True
+
+    # Claims the boxes picked up by a plan, returns False on a conflict
+    def claim(self, robot, plan):
+        boxes = [act[1] for act in plan if act[0] == 'pickup']
+        for box in boxes:
+            holder = self.claims.get(box, robot.name)
+            if holder != robot.name:
+                self.conflicts.append((self.scheduler.now, robot.name, box, holder))
+                return False
+        for box in boxes:
+            self.claims[box] = robot.name
+        return True
+
+    # Releases the resources a robot holds (doors leased across actions included),
+    #       but the point it stands on
+    def release_held(self, robot):
+        for resource in [r for r, owner in self.scheduler.owners.items()
+                         if owner == robot.name and r != ('point', robot.pos)]:
+            self.scheduler.release(resource, robot.name)
+
+    # Executes a plan of a robot, returns True if it is completed, False if
+    #       it failed, None if it was preempted
+    async def execute_plan(self, robot, plan):
+        if not self.claim(robot, plan):
+            self.failed.append((robot.name, None))
+            return False
+        result = True
+        for i, act in enumerate(plan):
+            nxt = plan[i + 1] if i + 1 < len(plan) else None
+            try:
+                done = await self.step(robot, act, nxt)
+            except Preempted:
+                self.release_held(robot)
+                self.failed.append((robot.name, act))
+                result = None
+                break
+            if not done:
+                self.release_held(robot)
+                self.failed.append((robot.name, act))
+                result = False
+                break
+        else:
+            self.completed.append((robot.name, self.scheduler.now))
+        for box in [box for box in self.claims if self.claims[box] == robot.name]:
+            del self.claims[box]
+        return result
+
+    # Executes the plans of a robot, one after the other
+    async def execute(self, robot, plans):
+        for plan in plans:
+            await self.execute_plan(robot, plan)
+
+    def run(self, plans):
+        """
+        Executes the plans of the robots concurrently
+        :param plans: a dict robot name -> list of plans, each plan a list of actions
+        :return: a report dict: plans completed and failed, pickup conflicts,
+            deadlocked robots, simulated time and throughput in plans per simulated hour
+        """
+        names = list(plans)
+        coros = [self.execute(self.robots[n], plans[n]) for n in names]
+        deadlocked = asyncio.run(self.scheduler.run(coros))
+        now = self.scheduler.now
+        return {'completed': len(self.completed),
+                'failed': len(self.failed),
+                'conflicts': len(self.conflicts),
+                'deadlocked': [names[i] for i in deadlocked],
+                'time': now,
+                'throughput': len(self.completed) * 3600.0 / now if now > 0 else 0.0}
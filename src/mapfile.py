@@ -0,0 +1,161 @@
+import sys
+import json
+import mmap
+import struct
+from array import array
+import simulator
+
+# *************************************************
+# Binary map files: the world of a simulator.Map with its indices.
+# - A header, a table of sections, then the sections, each aligned
+#       on 8 bytes: the names of the rooms, points, doors and boxes
+#       (UTF-8, one per line), the index arrays of Map.make_graph
+#       (little-endian 32-bit integers), and a small JSON section
+#       with the objects of the rooms, the door statuses and the boxes.
+# - load() maps the file in memory: the index arrays are views of
+#       the mapped pages (no copy, no rebuild of the adjacency), and
+#       processes loading the same file share its pages.
+# - Layouts (the arguments of Map()) are converted from JSON, YAML
+#       (with PyYAML) or Python dicts.
+# *************************************************
+
+MAGIC = b'HTNMAP\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sII')    # magic, version, number of sections
+SECTION = struct.Struct('<8sQQ')   # name, offset, size in bytes
+
+NAMES = ('room_names', 'point_names', 'door_names')
+ARRAYS = ('point_room', 'door_points', 'room_start', 'room_points', 'door_start', 'point_doors')
+
+
+# Returns the bytes of an array of 32-bit integers, little-endian
+def array_bytes(values):
+    a = array('i', values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def save(simmap, path):
+    """
+    Writes a map to a binary map file
+    :param simmap: a simulator.Map()
+    :param path: path of the file
+    """
+    meta = {'rooms': simmap.rooms,
+            'status': [simmap.doors[d][2] for d in simmap.door_names],
+            'boxes': simmap.boxes,
+            'weights': simmap.weights}
+    sections = [(name, '\n'.join(getattr(simmap, name)).encode('utf-8')) for name in NAMES]
+    sections += [(name, array_bytes(getattr(simmap, name))) for name in ARRAYS]
+    sections.append(('meta', json.dumps(meta).encode('utf-8')))
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, data in sections:
+        offset = (offset + 7) & ~7
+        table.append((name, offset, len(data)))
+        offset += len(data)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections)))
+        for name, offset, size in table:
+            f.write(SECTION.pack(name[:8].encode('ascii'), offset, size))
+        for (name, data), (_, offset, size) in zip(sections, table):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+
+
+# Section names are cut to 8 bytes in the table
+def section_key(name):
+    return name[:8].encode('ascii').ljust(8, b'\0')
+
+
+def load(path, seed=None):
+    """
+    Loads a map from a binary map file, without copying or rebuilding its indices
+    :param path: path of the file
+    :param seed: seed of the random generator of the map, as in Map()
+    :return: a simulator.Map()
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    magic, version, count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(path + " is not a map file of version " + str(VERSION))
+    table = {}
+    for k in range(count):
+        name, offset, size = SECTION.unpack_from(mm, HEADER.size + k * SECTION.size)
+        table[name] = view[offset:offset + size]
+    index = {}
+    for name in NAMES:
+        data = bytes(table[section_key(name)])
+        index[name] = data.decode('utf-8').split('\n') if data else []
+    for name in ARRAYS:
+        data = table[section_key(name)]
+        if sys.byteorder == 'little':
+            index[name] = data.cast('i')
+        else:
+            a = array('i', bytes(data))
+            a.byteswap()
+            index[name] = a
+    meta = json.loads(bytes(table[section_key('meta')]).decode('utf-8'))
+    rooms = index['room_names']
+    points = index['point_names']
+    point_room = index['point_room']
+    door_points = index['door_points']
+    nodes = dict(zip(points, map(rooms.__getitem__, point_room)))
+    ends = list(map(points.__getitem__, door_points))
+    doors = {d: [ends[2 * k], ends[2 * k + 1], meta['status'][k]]
+             for k, d in enumerate(index['door_names'])}
+    return simulator.Map(rooms=meta['rooms'], nodes=nodes, doors=doors, boxes=meta['boxes'],
+                         seed=seed, index=index, weights=meta.get('weights'))
+
+
+def read_json(path):
+    """
+    Reads a layout from a JSON file with 'rooms', 'nodes', 'doors' and 'boxes'
+    :return: the arguments of simulator.Map()
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_yaml(path):
+    """
+    Reads a layout from a YAML file with 'rooms', 'nodes', 'doors' and 'boxes'
+    :return: the arguments of simulator.Map()
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("reading YAML layouts needs PyYAML (pip install pyyaml)")
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def convert(layout, path):
+    """
+    Writes a layout to a binary map file
+    :param layout: the arguments of simulator.Map() (as Map.layout() returns them),
+        or the path of a JSON or YAML file holding them
+    :param path: path of the map file
+    """
+    if isinstance(layout, str):
+        if layout.endswith(('.yaml', '.yml')):
+            layout = read_yaml(layout)
+        else:
+            layout = read_json(layout)
+    saved = simulator.USE_GUI
+    simulator.USE_GUI = False
+    try:
+        simmap = simulator.Map(**layout)
+    finally:
+        simulator.USE_GUI = saved
+    save(simmap, path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python mapfile.py layout.json|layout.yaml map.bin")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,211 @@
+from collections import OrderedDict
+import pyhop
+import navigate
+
+# *************************************************
+# Cache of the decompositions of the planner's tasks.
+# - For the tasks in TASKS, install() puts a cached method before the
+#       methods of the domain. It looks up the plan of the task in the
+#       part of the state the task depends on: the robot (position,
+#       boxes carried, capacity and weight limit), the weights of the
+#       boxes, the doors and the boxes named in the task. The
+#       recursive navigate3/navigate4 methods also read the doors
+#       crossed and the points visited, which are then in the key.
+# - On a miss the task is planned alone with the methods of the
+#       domain, and the plan (or the failure) is stored in an LRU cache.
+# - A cached plan is tried first; if the tasks after it fail, pyhop
+#       backtracks to the methods of the domain as before. A cached
+#       failure fails the task at once.
+# - The cache is emptied when the domain changes: methods or operators
+#       declared again, or use_map() called with another map.
+# *************************************************
+
+TASKS = ('navigate_to', 'fetch', 'transport')  # tasks whose decompositions are cached
+
+_MISSING = object()
+
+
+class LRU:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        value = self.items.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Memo:
+
+    def __init__(self, capacity=10000, tasks=TASKS):
+        """
+        :param capacity: number of plans, and of failures, kept
+        :param tasks: names of the tasks whose decompositions are cached
+        """
+        self.plans = LRU(capacity)     # key -> plan of the task
+        self.failures = LRU(capacity)  # key -> True if the task has no plan
+        self.tasks = tasks
+        self.originals = {}  # task -> methods of the domain
+        self.wrapped = {}    # task -> methods installed in pyhop
+        self.fingerprint = None  # (map, methods, operators) the cache was filled with
+        self.history = False  # True if the methods read state.crossed and state.visited
+        self.running = set()  # keys being planned
+        self.failed = None    # (state, task) failed by the cached method
+        self.hits = 0
+        self.misses = 0
+        self.failure_hits = 0
+
+    # Identifies the domain: the methods, the operators and the map
+    def domain(self):
+        return (navigate.graph, dict(pyhop.methods), dict(pyhop.operators))
+
+    # Empties the cache if the domain changed, wraps the tasks declared again.
+    #       The fingerprint is only built on a change: a lookup compares it
+    #       with the tables of pyhop as they are.
+    def check(self):
+        fingerprint = self.fingerprint
+        if fingerprint is not None and navigate.graph is fingerprint[0] and \
+                pyhop.methods == fingerprint[1] and pyhop.operators == fingerprint[2]:
+            return
+        self.plans.clear()
+        self.failures.clear()
+        for task in self.tasks:
+            if task in pyhop.methods and pyhop.methods[task] is not self.wrapped.get(task):
+                self.wrap(task)
+        self.history = self.originals.get('navigate_to') != [navigate.navigate_route]
+        self.fingerprint = self.domain()
+
+    def key(self, state, task):
+        doors = state.doors
+        doors = doors.key() if hasattr(doors, 'key') else frozenset(doors.items())
+        weights = state.weights
+        weights = weights.key() if hasattr(weights, 'key') else frozenset(weights.items())
+        key = (task, state.pos['me'], tuple(state.load), state.capacity, state.max_weight, weights, doors)
+        boxes = tuple(state.pos[a] for a in task[1:] if a != 'me' and a in state.pos)
+        if boxes:
+            key += boxes
+        if self.history:
+            key += (tuple(state.crossed), tuple(state.visited))
+        return key
+
+    # Plans a task alone with the methods of the domain, as seek_plan does
+    def search(self, state, task):
+        for method in self.originals[task[0]]:
+            subtasks = method(state, *task[1:])
+            if subtasks is not False:
+                plan = pyhop.seek_plan(state, subtasks, [], 0, 0)
+                if plan is not False:
+                    return plan
+        return False
+
+    def cached_method(self, name):
+        def cached(state, *args):
+            self.check()
+            task = (name,) + args
+            key = self.key(state, task)
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.hits += 1
+                return list(plan)
+            if self.failures.get(key) is not None:
+                self.failure_hits += 1
+            elif key in self.running:
+                return False
+            else:
+                self.misses += 1
+                self.running.add(key)
+                try:
+                    plan = self.search(state, task)
+                finally:
+                    self.running.discard(key)
+                if plan is not False:
+                    self.plans.put(key, tuple(plan))
+                    return plan
+                self.failures.put(key, True)
+            self.failed = (state, task)
+            return False
+        cached.__name__ = 'cached_' + name
+        return cached
+
+    # A method of the domain, skipped when the cached method found no plan
+    def fallback(self, name, method):
+        def wrapper(state, *args):
+            failed = self.failed
+            if failed is not None and failed[0] is state and failed[1] == (name,) + args:
+                return False
+            return method(state, *args)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    def wrap(self, task):
+        self.originals[task] = pyhop.methods[task]
+        self.wrapped[task] = [self.cached_method(task)] + [self.fallback(task, m) for m in self.originals[task]]
+        pyhop.methods[task] = self.wrapped[task]
+
+    def print(self):
+        lookups = self.hits + self.misses + self.failure_hits
+        print('-'.__mul__(30))
+        print('{:<20}{:>10}'.format('PLANS:', len(self.plans)))
+        print('{:<20}{:>10}'.format('FAILURES:', len(self.failures)))
+        print('{:<20}{:>10}'.format('HITS:', self.hits))
+        print('{:<20}{:>10}'.format('FAILURE HITS:', self.failure_hits))
+        print('{:<20}{:>10}'.format('MISSES:', self.misses))
+        print('{:<20}{:>10}'.format('EVICTIONS:', self.plans.evictions + self.failures.evictions))
+        if lookups:
+            print('{:<20}{:>10.1%}'.format('HIT RATE:', (self.hits + self.failure_hits) / lookups))
+        print('-'.__mul__(30))
+
+
+_installed = None  # the Memo() while installed
+
+
+def install(memo=None):
+    """
+    Starts caching the decompositions of the tasks declared so far
+    :param memo: the Memo() to use, or None for a new one
+    :return: the Memo()
+    """
+    global _installed
+    if _installed is not None:
+        uninstall()
+    if memo is None:
+        memo = Memo()
+    memo.wrapped = {}
+    memo.fingerprint = None
+    memo.check()
+    _installed = memo
+    return memo
+
+
+def uninstall():
+    """
+    Stops caching: puts the methods of the domain back, except those declared again since
+    :return: the Memo(), or None if none was installed
+    """
+    global _installed
+    memo = _installed
+    if memo is None:
+        return None
+    for task, methods in memo.wrapped.items():
+        if pyhop.methods.get(task) is methods:
+            pyhop.methods[task] = memo.originals[task]
+    _installed = None
+    return memo
@@ -0,0 +1,211 @@
+import numpy as np
+import simulator
+import pathplan
+
+# *************************************************
+# Monte Carlo simulation of the sense-plan-act loop in the dynamic
+#       world (simulator.DYNAMIC_WORLD), with NumPy arrays holding
+#       the state of thousands of episodes at once.
+# - As in Map.reshuffle, after each moveto of the robot the box
+#       moves to a random point unless random() <= probability.
+# - The robot follows the route planned to where the box was when
+#       it planned; when the box is not there at the pickup, the
+#       plan fails and the robot replans from its position, as the
+#       loop of toplevel_task2.top_level does.
+# - Only the box of the task is simulated: the other boxes do not
+#       change the outcome of the task.
+# - Each batch of episodes draws from its own random stream,
+#       spawned from the seed, so results are reproducible.
+# *************************************************
+
+
+# Routes of a map to the goals the episodes use, built on demand.
+# - Inside a room the robot moves straight to the goal. From the other
+#       rooms, the goals of a room that are not at a door are reached
+#       by the same routes, so they share one row of next hops; a goal
+#       at a door has its own row.
+# - The hop durations are kept over the arcs only: a block of k * k
+#       movetos per room of k points, and the door arcs.
+class Routes:
+    def __init__(self, simmap, model):
+        graph = pathplan.RouteGraph(simmap)
+        self.table = pathplan.RouteTable(graph)
+        self.table.sync({d: simmap.doors[d][2] for d in simmap.doors})
+        self.names = names = simmap.point_names
+        self.ids = simmap.point_ids
+        self.n = n = len(names)
+        self.room = np.asarray(simmap.point_room, dtype=np.int64)
+        start = np.asarray(simmap.room_start, dtype=np.int64)
+        points = np.asarray(simmap.room_points, dtype=np.int64)
+        self.size = np.diff(start)
+        self.local = np.empty(n, dtype=np.int64)    # rank of a point in its room
+        self.local[points] = np.arange(len(points)) - np.repeat(start[:-1], self.size)
+        self.block = np.concatenate([[0], np.cumsum(self.size ** 2)])
+        if model.distance is None:
+            self.move_time = np.full(self.block[-1], model.duration('moveto'))
+        else:
+            self.move_time = np.zeros(self.block[-1])
+            for r in range(len(self.size)):
+                room = points[start[r]:start[r + 1]].tolist()
+                self.move_time[self.block[r]:self.block[r + 1]] = [
+                    model.duration('moveto', names[p], names[q]) if p != q else 0.0
+                    for p in room for q in room]
+        # door arcs, sorted on p * n + q
+        ends = np.asarray(simmap.door_points, dtype=np.int64).reshape(-1, 2)
+        arcs = np.concatenate([ends, ends[:, ::-1]])
+        cost = np.empty(len(arcs))
+        for k, (p, q) in enumerate(arcs.tolist()):
+            cost[k] = model.duration('cross', names[p], names[q])
+            if simmap.doors[simmap.door_names[k % len(ends)]][2] != 'open':
+                cost[k] += model.duration('open') + model.duration('close')
+        keys = arcs[:, 0] * n + arcs[:, 1]
+        order = np.argsort(keys)
+        self.door_keys = keys[order]
+        self.door_time = cost[order]
+        # the goal whose row a goal uses: itself at a door, else the first
+        #       point of its room not at a door
+        at_door = np.zeros(n, dtype=bool)
+        at_door[ends.ravel()] = True
+        first = np.full(len(self.size), -1, dtype=np.int64)
+        inside = points[~at_door[points]]
+        first[self.room[inside[::-1]]] = inside[::-1]
+        self.owner = np.where(at_door, np.arange(n), first[self.room])
+        self.row = np.full(n, -1, dtype=np.int64)
+        self.nxt = np.full((0, n), -1, dtype=np.int32)
+        self.count = 0
+
+    # Builds the rows of the goal owners (ids) that have none yet
+    def need(self, owners):
+        for g in np.unique(owners[self.row[owners] < 0]).tolist():
+            if self.count == len(self.nxt):
+                self.nxt = np.resize(self.nxt, (max(16, 2 * self.count), self.n))
+            hop = self.table.tree(self.names[g])[1]
+            self.table.trees.clear()    # the row keeps all that is needed
+            ids = self.ids
+            self.nxt[self.count] = -1
+            self.nxt[self.count, g] = g
+            self.nxt[self.count, [ids[p] for p in hop]] = [ids[q] for q in hop.values()]
+            self.row[g] = self.count
+            self.count += 1
+
+    def hop(self, goal, robot):
+        """
+        Next points of the robots on the routes to their goals
+        :param goal: ids of the goals
+        :param robot: ids of the robot positions
+        :return: ids of the next points, -1 where the goal is unreachable
+        """
+        owner = self.owner[goal]
+        self.need(owner)
+        nxt = self.nxt[self.row[owner], robot]
+        return np.where(self.room[robot] == self.room[goal], goal, nxt).astype(np.int32)
+
+    def step(self, frm, to):
+        """
+        Durations of hops between adjacent points
+        :param frm: ids of the points left
+        :param to: ids of the points reached
+        :return: (durations, True for the movetos) arrays
+        """
+        r = self.room[frm]
+        move = r == self.room[to]
+        time = np.empty(len(frm))
+        i = self.block[r[move]] + self.local[frm[move]] * self.size[r[move]] + self.local[to[move]]
+        time[move] = self.move_time[i]
+        keys = frm[~move].astype(np.int64) * self.n + to[~move]
+        time[~move] = self.door_time[np.searchsorted(self.door_keys, keys)]
+        return time, move
+
+
+# Simulates a batch of episodes, returns (success, replans, time) arrays
+def run_batch(rng, episodes, start, box, dest, routes, durations,
+              probability, max_steps, max_replans):
+    n = routes.n
+    robot = np.full(episodes, start, dtype=np.int32)
+    boxpos = np.full(episodes, box, dtype=np.int32)
+    goal = boxpos.copy()                            # where the plan goes
+    phase = np.zeros(episodes, dtype=np.int8)       # 0 fetching, 1 carrying, 2 done, 3 failed
+    replans = np.zeros(episodes, dtype=np.int32)
+    clock = np.zeros(episodes)
+    for step in range(max_steps):
+        active = phase < 2
+        if not active.any():
+            break
+        arrived = active & (robot == goal)
+        # pickup: succeeds if the box is still there, else the robot replans
+        fetch = arrived & (phase == 0)
+        found = fetch & (boxpos == robot)
+        clock[found] += durations['pickup']
+        if dest < 0:
+            phase[found] = 2
+        else:
+            phase[found] = 1
+            goal[found] = dest
+        missed = fetch & ~found
+        replans[missed] += 1
+        goal[missed] = boxpos[missed]
+        phase[missed & (replans > max_replans)] = 3
+        # putdown at the destination
+        deliver = arrived & (phase == 1) & (robot == dest)
+        clock[deliver] += durations['putdown']
+        phase[deliver] = 2
+        # one hop along the route for the others
+        walking = (phase < 2) & (robot != goal)
+        hop = routes.hop(goal[walking], robot[walking])
+        blocked = hop < 0
+        idx = np.flatnonzero(walking)
+        phase[idx[blocked]] = 3
+        idx = idx[~blocked]
+        hop = hop[~blocked]
+        time, move = routes.step(robot[idx], hop)
+        clock[idx] += time
+        moved = idx[move]
+        robot[idx] = hop
+        # reshuffle after the moves, for the boxes not carried yet
+        moved = moved[phase[moved] == 0]
+        shuffled = moved[rng.random(len(moved)) > probability]
+        boxpos[shuffled] = rng.integers(0, n, len(shuffled))
+    return phase == 2, replans, clock
+
+
+def simulate(simmap, task, start, probability=0.5, episodes=10000, seed=0,
+             model=None, max_steps=1000, max_replans=100, batch=10000):
+    """
+    Simulates many episodes of a task in the dynamic world
+    :param simmap: a simulator.Map(), giving the points, doors and the box position
+    :param task: ('fetch', box) or ('transport', box, point)
+    :param start: starting point of the robot
+    :param probability: as in Map.reshuffle, a box moves when random() > probability
+    :param episodes: number of episodes
+    :param seed: seed of the random streams
+    :param model: the simulator.TimeModel() of the actions
+    :param max_steps: budget of hops of an episode
+    :param max_replans: budget of replans of an episode
+    :param batch: number of episodes simulated at once
+    :return: a dict with the success rate, and the mean and percentiles
+        (50, 90, 99) of the replans and of the completion time of successes
+    """
+    if model is None:
+        model = simulator.TimeModel()
+    routes = Routes(simmap, model)
+    ids = simmap.point_ids
+    box = ids[simmap.boxes[task[1]]]
+    dest = ids[task[2]] if task[0] == 'transport' else -1
+    durations = {'pickup': model.duration('pickup'), 'putdown': model.duration('putdown')}
+    streams = np.random.SeedSequence(seed).spawn((episodes + batch - 1) // batch)
+    results = []
+    for i, stream in enumerate(streams):
+        size = min(batch, episodes - i * batch)
+        results.append(run_batch(np.random.default_rng(stream), size, ids[start], box, dest,
+                                 routes, durations, probability, max_steps, max_replans))
+    success = np.concatenate([r[0] for r in results])
+    replans = np.concatenate([r[1] for r in results])
+    clock = np.concatenate([r[2] for r in results])[success]
+    report = {'episodes': episodes,
+              'success_rate': float(success.mean()),
+              'replans_mean': float(replans.mean()),
+              'replans_percentiles': np.percentile(replans, [50, 90, 99]).tolist()}
+    if len(clock):
+        report['time_mean'] = float(clock.mean())
+        report['time_percentiles'] = np.percentile(clock, [50, 90, 99]).tolist()
+    return report
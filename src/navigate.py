@@ -1,16 +1,73 @@
 
+from collections import defaultdict
 import pyhop
 import map
+import pathplan
+import events
+from persistent import PersistentDict, PersistentList
 
+# Planning state. Its dicts and lists are stored as copy-on-write
+#       containers, so the copies made by the planner at each operator
+#       share them instead of deep-copying them.
 class State(pyhop.State):
     def __init__(self):
         self.__name__ = "s1"
         self.pos = {}           # positions of me and boxes
         self.doors = {}         # doors' status: closed or open
-        self.carry = None       # what boxes the me is carrying
+        self.carry = None       # the box 'me' picked up last and still carries
+        self.load = []          # the boxes 'me' is carrying
+        self.capacity = 1       # number of boxes 'me' can carry
+        self.max_weight = None  # total weight 'me' can carry, None for no limit
+        self.weights = {}       # weights of the boxes, 1 if not given
         self.crossed = []       # list of doors tried so far during planning
         self.visited = []       # list of positions tried so far during planning
 
+    def __setattr__(self, name, value):
+        if type(value) is dict:
+            value = PersistentDict(value)
+        elif type(value) is list:
+            value = PersistentList(value)
+        object.__setattr__(self, name, value)
+
+    def __deepcopy__(self, memo):
+        new = type(self).__new__(type(self))
+        for name, value in vars(self).items():
+            if isinstance(value, (PersistentDict, PersistentList)):
+                value = value.copy()
+            object.__setattr__(new, name, value)
+        return new
+
+
+def read_state(robot, state=None):
+    """
+    Reads the current world state from the simulator, as get_state does
+    :param robot: a simulator.Robot()
+    :param state: a State() to fill in, or None for a new one
+    :return: the state
+    """
+    if state is None:
+        state = State()
+    state.pos['me'] = robot.pos
+    state.carry = robot.carry
+    state.load = list(robot.load)
+    state.capacity = robot.capacity
+    state.max_weight = robot.max_weight
+    state.weights = robot.map.weights
+    state.crossed = []
+    state.doors = {}
+    for d in robot.map.doors:
+        state.doors[d] = robot.map.doors[d][2]
+    for b in robot.map.boxes:
+        state.pos[b] = robot.map.boxes[b]
+    return state
+
+
+# Publishes a state as a 'state' event, as pyhop.print_state prints it
+def publish_state(state, log=events.default):
+    if log is not None and log.enabled:
+        values = {name: events.plain(value) for name, value in vars(state).items() if name != '__name__'}
+        log.publish('state', name=state.__name__, values=values)
+
 
 # Helper function to find an item in a list that matches a predicate
 def some(predicate, candidates):
@@ -95,10 +152,23 @@ def close(state, d):
 # Registers the 'open' and 'close' functions as Pyhop operators for modifying the state
 pyhop.declare_operators(open, close)
 
+# Door policy: True to leave open the doors the robot opens, which saves
+#       closing them and opening them again when a later task crosses them.
+#       use_map() captures it with the costs of the routes.
+KEEP_DOORS_OPEN = False
+
+
+# Returns the door policy in force: the one of the map in use, else KEEP_DOORS_OPEN
+def keep_doors_open():
+    return graph.keep_open if graph is not None else KEEP_DOORS_OPEN
+
+
 # Method to handle the process of opening a door from one side
 def openFirstDoor(state, d):
     p1, p2 = map.doors[d]
     if state.doors[d] == 'close' and state.pos['me'] == p1:
+            if keep_doors_open():
+                return [('open', d), ('cross', d, p2)]
             return [('open', d), ('cross', d, p2), ('close', d)]
     return False
 
@@ -107,6 +177,8 @@ def openFirstDoor(state, d):
 def openSecondDoor(state, d):
     p1, p2 = map.doors[d]
     if state.doors[d] == 'close' and state.pos['me'] == p2:
+            if keep_doors_open():
+                return [('open', d), ('cross', d, p1)]
             return [('open', d), ('cross', d, p1), ('close', d)]
     return False
 
@@ -114,14 +186,28 @@ def openSecondDoor(state, d):
 pyhop.declare_methods('open_door', openFirstDoor, openSecondDoor)
 
 
+# Returns True if 'me' has room for one more box
+def fits(state, box):
+    if len(state.load) >= state.capacity:
+        return False
+    if state.max_weight is None:
+        return True
+    weight = sum(state.weights.get(b, 1) for b in state.load)
+    return weight + state.weights.get(box, 1) <= state.max_weight
+
+
 def pickup(state, box):
+    if box in state.load or state.pos[box] != state.pos['me'] or not fits(state, box):
+        return False
     state.carry = box  # Updates the state to show that 'me' is carrying the box
+    state.load.append(box)
     return state
 
 
 def putdown(state, box):
-    if state.carry == box:
-        state.carry = None  # Clears the carried object from the state
+    if box in state.load:
+        state.load.remove(box)
+        state.carry = state.load[-1] if state.load else None  # Clears the carried object from the state
         state.pos[box] = state.pos['me']  # Updates the box's location to 'me's current position
         return state
     else:
@@ -147,15 +233,15 @@ pyhop.declare_methods('fetch', ToFetch)
 # Method to define how to transport an object
 def transportFunction(state, box, p1):
         # Various conditions to handle the state changes needed to transport a bo
-    if(state.carry == box and p1 == state.pos['me']):
+    if(box in state.load and p1 == state.pos['me']):
         return [('putdown', box)]
-    elif(state.carry == box and p1 != state.pos['me']):
+    elif(box in state.load and p1 != state.pos['me']):
         return [('navigate_to', p1),('putdown', box)]
-    elif(state.carry == None and state.pos[box]==state.pos['me'] and p1 != state.pos['me']):
+    elif(fits(state, box) and state.pos[box]==state.pos['me'] and p1 != state.pos['me']):
         return [('pickup', box), ('navigate_to', p1),('putdown', box)]
-    elif((state.carry == None and state.pos[box] != state.pos['me'] and p1 != state.pos['me'])):
+    elif((fits(state, box) and state.pos[box] != state.pos['me'] and p1 != state.pos['me'])):
         return [('navigate_to', state.pos[box]), ('pickup', box), ('navigate_to', p1),('putdown', box)]
-    elif((state.carry == None and state.pos[box] != state.pos['me'] and p1 == state.pos['me'])):
+    elif((fits(state, box) and state.pos[box] != state.pos['me'] and p1 == state.pos['me'])):
         return [('navigate_to', state.pos[box]), ('pickup', box), ('navigate_to', p1),('putdown', box)]
     else:
         return False
@@ -207,3 +293,61 @@ def navigate4(state, p):
 
 pyhop.declare_methods('navigate_to', navigate1, navigate2, navigate3, navigate4)
 
+
+# Navigation with the path planning engine
+
+graph = None  # pathplan.RouteGraph (or RoomRouter) of the map, set by use_map()
+routes = None  # pathplan.RouteTable of graph (or the RoomRouter), shared by all the plans on the map
+
+
+# Method for navigating along the cheapest route found by the path planning engine
+def navigate_route(state, p):
+    if p not in graph.nodes:
+        return False  # not a point: a box carried by another robot
+    route = routes.route(state.pos['me'], p, state.doors)
+    if route is None:
+        return False
+    return graph.steps(route, state.doors)
+
+
+# Doors all seen as open, to find the routes through closed doors
+ALL_OPEN = defaultdict(lambda: 'open')
+
+
+# Method for navigating along the route that would be the cheapest with all
+#       the doors open, when it differs from the cheapest one: it opens closed
+#       doors to take a shortcut, which can pay off for the tasks after it
+#       when the doors are left open
+def navigate_shortcut(state, p):
+    if not hasattr(graph, 'shortest_path'):
+        return False
+    route = graph.shortest_path(state.pos['me'], p, ALL_OPEN)
+    if route is None or route == routes.route(state.pos['me'], p, state.doors):
+        return False
+    return graph.steps(route, state.doors)
+
+
+def use_map(simmap, hierarchical=False, model=None, shortcuts=False):
+    """
+    Plan 'navigate_to' tasks with the path planning engine instead of
+    the recursive door enumeration of navigate3/navigate4
+    :param simmap: a simulator.Map()
+    :param hierarchical: True to plan over the rooms first (pathplan.RoomRouter),
+        for buildings with many rooms
+    :param model: a simulator.TimeModel() giving the costs of the steps (with the
+        door policy KEEP_DOORS_OPEN), or None for the default costs of pathplan
+    :param shortcuts: True to add navigate_shortcut as an alternative, for the
+        cost-optimal planner of costplan.py
+    """
+    global graph, routes
+    costs = {} if model is None else pathplan.model_costs(model, KEEP_DOORS_OPEN)
+    if hierarchical:
+        graph = routes = pathplan.RoomRouter(simmap, keep_open=KEEP_DOORS_OPEN, **costs)
+    else:
+        graph = pathplan.RouteGraph(simmap, keep_open=KEEP_DOORS_OPEN, **costs)
+        routes = pathplan.RouteTable(graph)
+    if shortcuts:
+        pyhop.declare_methods('navigate_to', navigate_route, navigate_shortcut)
+    else:
+        pyhop.declare_methods('navigate_to', navigate_route)
+
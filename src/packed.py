@@ -0,0 +1,316 @@
+import weakref
+from array import array
+from collections.abc import MutableMapping, MutableSequence
+import navigate
+from persistent import PersistentDict, PersistentList
+
+# *************************************************
+# Packed planning states.
+# - An Encoding numbers the points and doors of a map (with the ids
+#       of simulator.Map) and the objects with a position ('me' and
+#       the boxes). A position which is not a point (the robot
+#       carrying a box) is kept aside by the state, not numbered.
+# - PackedState is a navigate.State whose containers are packed:
+#       'pos' an array of point ids, 'doors' two bitsets (doors known,
+#       doors open), 'crossed' and 'visited' bitsets of door and point
+#       ids. They keep the interface of the dicts and lists, so the
+#       operators, the methods and get_state work on them unchanged;
+#       membership is O(1) and a copy shares the data until written.
+# - key() is a small hashable summary of the state (bytes and ints),
+#       for duplicate detection; route tables skip their door check
+#       when the door bitset did not change.
+# - A closed door reads 'close', as the operators write it.
+# *************************************************
+
+MISSING = -2 ** 31  # position of a key not set
+OTHER = -1          # position which is not a point, kept aside
+
+
+class Encoding:
+
+    def __init__(self, simmap):
+        """
+        :param simmap: a simulator.Map()
+        """
+        self.point_names = simmap.point_names
+        self.point_ids = simmap.point_ids
+        self.door_names = simmap.door_names
+        self.door_ids = simmap.door_ids
+        self.keys = ['me'] + sorted(simmap.boxes)  # objects with a position
+        self.key_ids = {k: i for i, k in enumerate(self.keys)}
+
+    # Returns the index of a key, numbering it if new
+    def key_id(self, key):
+        i = self.key_ids.get(key)
+        if i is None:
+            i = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return i
+
+
+_encodings = weakref.WeakKeyDictionary()  # map -> Encoding(), while the map is alive
+
+
+def encoding(simmap):
+    """
+    :return: the Encoding() of a map, shared by the states of the map
+    """
+    enc = _encodings.get(simmap)
+    if enc is None:
+        enc = _encodings[simmap] = Encoding(simmap)
+    return enc
+
+
+# Yields the indices of the bits set in an integer
+def bits_of(x):
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+
+class Positions(MutableMapping):
+    __slots__ = ('encoding', '_items', '_others', '_owned')
+
+    def __init__(self, encoding, items=()):
+        self.encoding = encoding
+        self._items = array('i', [MISSING]) * len(encoding.keys)
+        self._others = {}   # key index -> position which is not a point
+        self._owned = True  # False while _items and _others are shared with a copy
+        for key, value in dict(items).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        i = self.encoding.key_ids.get(key)
+        if i is None or i >= len(self._items) or self._items[i] == MISSING:
+            raise KeyError(key)
+        p = self._items[i]
+        if p == OTHER:
+            return self._others[i]
+        return self.encoding.point_names[p]
+
+    def _own(self):
+        if not self._owned:
+            self._items = array('i', self._items)
+            self._others = dict(self._others)
+            self._owned = True
+
+    def __setitem__(self, key, value):
+        i = self.encoding.key_id(key)
+        self._own()
+        if i >= len(self._items):
+            self._items.extend([MISSING] * (i + 1 - len(self._items)))
+        p = self.encoding.point_ids.get(value)
+        if p is None:
+            self._items[i] = OTHER
+            self._others[i] = value
+        else:
+            self._items[i] = p
+            self._others.pop(i, None)
+
+    def __delitem__(self, key):
+        self[key]  # raises KeyError if missing
+        i = self.encoding.key_ids[key]
+        self._own()
+        self._items[i] = MISSING
+        self._others.pop(i, None)
+
+    def __iter__(self):
+        for key, i in zip(self.encoding.keys, self._items):
+            if i != MISSING:
+                yield key
+
+    def __len__(self):
+        return sum(1 for i in self._items if i != MISSING)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        new = Positions.__new__(Positions)
+        new.encoding = self.encoding
+        new._items = self._items
+        new._others = self._others
+        new._owned = False
+        self._owned = False
+        return new
+
+    def key(self):
+        if self._others:
+            return self._items.tobytes(), tuple(sorted(self._others.items()))
+        return self._items.tobytes()
+
+
+class DoorBits(MutableMapping):
+    __slots__ = ('encoding', 'known_bits', 'open_bits')
+
+    def __init__(self, encoding, items=()):
+        self.encoding = encoding
+        self.known_bits = 0  # doors with a status
+        self.open_bits = 0   # doors open
+        for d, status in dict(items).items():
+            self[d] = status
+
+    def __getitem__(self, d):
+        i = self.encoding.door_ids[d]
+        if not self.known_bits >> i & 1:
+            raise KeyError(d)
+        return 'open' if self.open_bits >> i & 1 else 'close'
+
+    def __setitem__(self, d, status):
+        bit = 1 << self.encoding.door_ids[d]
+        self.known_bits |= bit
+        if status == 'open':
+            self.open_bits |= bit
+        else:
+            self.open_bits &= ~bit
+
+    def __delitem__(self, d):
+        self[d]  # raises KeyError if missing
+        bit = 1 << self.encoding.door_ids[d]
+        self.known_bits &= ~bit
+        self.open_bits &= ~bit
+
+    def __iter__(self):
+        names = self.encoding.door_names
+        return (names[i] for i in bits_of(self.known_bits))
+
+    def __len__(self):
+        return bin(self.known_bits).count('1')
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        new = DoorBits.__new__(DoorBits)
+        new.encoding = self.encoding
+        new.known_bits = self.known_bits
+        new.open_bits = self.open_bits
+        return new
+
+    def key(self):
+        return self.known_bits, self.open_bits
+
+
+# A set of doors or points used as a list (append, in, iteration), in the order of their ids
+class BitSet(MutableSequence):
+    __slots__ = ('names', 'ids', 'bits')
+
+    def __init__(self, names, ids, items=()):
+        """
+        :param names: the names of the members, by id
+        :param ids: dict name -> id
+        """
+        self.names = names
+        self.ids = ids
+        self.bits = 0
+        for x in items:
+            self.append(x)
+
+    def __contains__(self, x):
+        i = self.ids.get(x)
+        return i is not None and self.bits >> i & 1 == 1
+
+    def __iter__(self):
+        names = self.names
+        return (names[i] for i in bits_of(self.bits))
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __getitem__(self, k):
+        return list(self)[k]
+
+    def __setitem__(self, k, x):
+        del self[k]
+        self.append(x)
+
+    def __delitem__(self, k):
+        self.remove(list(self)[k])
+
+    def insert(self, k, x):
+        self.append(x)
+
+    def append(self, x):
+        self.bits |= 1 << self.ids[x]
+
+    def remove(self, x):
+        if x not in self:
+            raise ValueError(x)
+        self.bits &= ~(1 << self.ids[x])
+
+    def __eq__(self, other):
+        if isinstance(other, BitSet):
+            return self.bits == other.bits
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def copy(self):
+        new = BitSet.__new__(BitSet)
+        new.names = self.names
+        new.ids = self.ids
+        new.bits = self.bits
+        return new
+
+
+class PackedState(navigate.State):
+    __slots__ = ('_encoding',)
+
+    def __init__(self, encoding):
+        """
+        :param encoding: the Encoding() of the map, see encoding()
+        """
+        object.__setattr__(self, '_encoding', encoding)
+        super().__init__()
+
+    def __setattr__(self, name, value):
+        enc = self._encoding
+        if name == 'pos':
+            value = value.copy() if isinstance(value, Positions) else Positions(enc, value)
+        elif name == 'doors':
+            value = value.copy() if isinstance(value, DoorBits) else DoorBits(enc, value)
+        elif name == 'crossed':
+            value = value.copy() if isinstance(value, BitSet) else BitSet(enc.door_names, enc.door_ids, value)
+        elif name == 'visited':
+            value = value.copy() if isinstance(value, BitSet) else BitSet(enc.point_names, enc.point_ids, value)
+        else:
+            super().__setattr__(name, value)
+            return
+        object.__setattr__(self, name, value)
+
+    def __deepcopy__(self, memo):
+        new = type(self).__new__(type(self))
+        object.__setattr__(new, '_encoding', self._encoding)
+        for name, value in vars(self).items():
+            if isinstance(value, (Positions, DoorBits, BitSet, PersistentDict, PersistentList)):
+                value = value.copy()
+            object.__setattr__(new, name, value)
+        return new
+
+    def key(self):
+        """
+        :return: a hashable summary of the state: positions, doors, doors crossed, points visited, load
+        """
+        return (self.pos.key(), self.doors.key(), self.crossed.bits, self.visited.bits,
+                self.carry, tuple(self.load))
+
+    def __eq__(self, other):
+        if not isinstance(other, PackedState):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def read_state(robot):
+    """
+    Reads the current world state from the simulator into a packed state, as navigate.read_state does
+    :param robot: a simulator.Robot()
+    :return: the PackedState()
+    """
+    return navigate.read_state(robot, PackedState(encoding(robot.map)))
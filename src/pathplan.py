@@ -0,0 +1,371 @@
+import heapq
+
+# *************************************************
+# Path planning engine for the navigation domain.
+# - Searches the arcs of a simulator.Map for the cheapest
+#       route between two points (Dijkstra), taking the
+#       status of the doors into account.
+# - Expands a route into the primitive steps of navigate.py
+#       (moveto, cross, open, close), so that a navigate_to
+#       task is decomposed in one shot instead of by trying
+#       doors recursively.
+# - Keeps next-hop tables of the routes, which are updated
+#       incrementally when doors are opened or closed.
+# - For large buildings, RoomRouter plans over the rooms first and
+#       refines only the rooms on the route into points.
+# *************************************************
+
+# Planning cost of each kind of step
+MOVE_COST = 1   # moving between two points of the same room
+CROSS_COST = 1  # crossing an open door
+OPEN_COST = 2   # opening and closing again a closed door
+
+
+def model_costs(model, keep_open=False):
+    """
+    Planning costs of the steps from the durations of the robot actions
+    :param model: a simulator.TimeModel() (its fixed durations only, not the arc lengths)
+    :param keep_open: True if the doors opened are left open, closing them then costs nothing
+    :return: the move_cost, cross_cost and open_cost arguments of RouteGraph()
+    """
+    durations = model.durations
+    return {'move_cost': durations['moveto'], 'cross_cost': durations['cross'],
+            'open_cost': durations['open'] + (0 if keep_open else durations['close'])}
+
+
+class RouteGraph:
+
+    # Builds the search graph from a simulator.Map; keep_open is the door policy of
+    #       the steps, which open_cost should account for (see model_costs)
+    def __init__(self, simmap, move_cost=MOVE_COST, cross_cost=CROSS_COST, open_cost=OPEN_COST,
+                 keep_open=False):
+        self.nodes = simmap.nodes
+        self.move_cost = move_cost
+        self.cross_cost = cross_cost
+        self.open_cost = open_cost
+        self.keep_open = keep_open
+        self.room_points = {r: simmap.points_of(r) for r in simmap.rooms}
+        self.point_doors = {}  # p -> [(door, point on the other side)]
+        self.door_at = {}   # (p, q) -> door between the two points
+        self.door_arcs = {}  # door -> (p, q)
+        for d in simmap.doors:
+            p, q = simmap.doors[d][0], simmap.doors[d][1]
+            self.point_doors.setdefault(p, []).append((d, q))
+            self.point_doors.setdefault(q, []).append((d, p))
+            self.door_at[(p, q)] = d
+            self.door_at[(q, p)] = d
+            self.door_arcs[d] = (p, q)
+
+    # Returns the cost of crossing door d
+    def door_cost(self, d, doors):
+        if doors[d] == 'open':
+            return self.cross_cost
+        return self.cross_cost + self.open_cost
+
+    # Returns the cost of going from p to the adjacent point q
+    def arc_cost(self, p, q, doors):
+        d = self.door_at.get((p, q))
+        if d is None:
+            return self.move_cost
+        return self.door_cost(d, doors)
+
+    # Yields the points adjacent to p with the cost of going there.
+    # All the points of a room are at the same cost from each other, so
+    #       a search only needs to visit the points of a room from the
+    #       first one it reaches: 'expanded' keeps the rooms already visited.
+    def successors(self, p, doors, expanded):
+        r = self.nodes[p]
+        if r not in expanded:
+            expanded.add(r)
+            for q in self.room_points[r]:
+                if q != p:
+                    yield q, self.move_cost
+        for d, q in self.point_doors.get(p, ()):
+            yield q, self.door_cost(d, doors)
+
+    def shortest_path(self, start, goal, doors):
+        """
+        Finds the cheapest route between two points
+        :param start: starting point
+        :param goal: point to reach
+        :param doors: status of the doors, as in navigate.State().doors
+        :return: the list of points from start to goal, or None if goal is unreachable
+        """
+        if start == goal:
+            return [start]
+        dist = {start: 0}
+        prev = {}
+        expanded = set()
+        queue = [(0, start)]
+        while queue:
+            c, p = heapq.heappop(queue)
+            if p == goal:
+                break
+            if c > dist[p]:
+                continue
+            for q, ac in self.successors(p, doors, expanded):
+                nc = c + ac
+                if nc < dist.get(q, nc + 1):
+                    dist[q] = nc
+                    prev[q] = p
+                    heapq.heappush(queue, (nc, q))
+        if goal not in prev:
+            return None
+        route = [goal]
+        while route[-1] != start:
+            route.append(prev[route[-1]])
+        route.reverse()
+        return route
+
+    def steps(self, route, doors, keep_open=None):
+        """
+        Expands a route into the primitive steps of the navigation domain
+        :param route: a list of points, as returned by shortest_path
+        :param doors: status of the doors, as in navigate.State().doors
+        :param keep_open: True to leave open the doors opened on the way, None for
+            the policy the graph was built with
+        :return: a list of operators (moveto, cross, open, close)
+        """
+        if keep_open is None:
+            keep_open = self.keep_open
+        steps = []
+        for p, q in zip(route, route[1:]):
+            d = self.door_at.get((p, q))
+            if d is None:
+                steps.append(('moveto', q))
+            elif doors[d] == 'open':
+                steps.append(('cross', d, q))
+            elif keep_open:
+                steps += [('open', d), ('cross', d, q)]
+            else:
+                steps += [('open', d), ('cross', d, q), ('close', d)]
+        return steps
+
+
+# *************************************************
+# Graph of the rooms: two rooms are adjacent when a door
+#       connects them, at the cost of the cheapest such door.
+# *************************************************
+class RoomGraph:
+
+    # Builds the room adjacency graph from a simulator.Map
+    def __init__(self, simmap, cross_cost=CROSS_COST, open_cost=OPEN_COST):
+        self.cross_cost = cross_cost
+        self.open_cost = open_cost
+        self.arcs = {r: set() for r in simmap.rooms}
+        self.doors_between = {}  # (r1, r2) -> doors connecting the two rooms
+        self.door_arcs = {}      # door -> (r1, r2)
+        for d in simmap.doors:
+            r1 = simmap.nodes[simmap.doors[d][0]]
+            r2 = simmap.nodes[simmap.doors[d][1]]
+            self.arcs[r1].add(r2)
+            self.arcs[r2].add(r1)
+            self.doors_between.setdefault((r1, r2), []).append(d)
+            self.doors_between.setdefault((r2, r1), []).append(d)
+            self.door_arcs[d] = (r1, r2)
+
+    # Returns the cost of crossing door d
+    def door_cost(self, d, doors):
+        if doors[d] == 'open':
+            return self.cross_cost
+        return self.cross_cost + self.open_cost
+
+    # Returns the cheapest door between two adjacent rooms and its cost
+    def best_door(self, r1, r2, doors):
+        best = None
+        for d in self.doors_between[(r1, r2)]:
+            c = self.door_cost(d, doors)
+            if best is None or c < best[1]:
+                best = (d, c)
+        return best
+
+    # Returns the cost of going from room r1 to the adjacent room r2
+    def arc_cost(self, r1, r2, doors):
+        return self.best_door(r1, r2, doors)[1]
+
+    # Yields the rooms adjacent to r with the cost of going there
+    def successors(self, r, doors, expanded):
+        for r2 in self.arcs[r]:
+            yield r2, self.arc_cost(r, r2, doors)
+
+
+# *************************************************
+# Two-level route planning: the cheapest route over the rooms (from
+#       a RouteTable of the RoomGraph, so room routes are kept and
+#       reused), refined into points in the rooms it traverses.
+# - The cost of a route grows with its number of rooms, not with
+#       the number of points of the building.
+# - The refinement picks, between two rooms of the route, the door
+#       cheapest to reach from the current point: the moves inside a
+#       room are not in the room graph, so a route may cost more than
+#       the one of a RouteGraph.
+# *************************************************
+class RoomRouter:
+
+    def __init__(self, simmap, move_cost=MOVE_COST, cross_cost=CROSS_COST, open_cost=OPEN_COST,
+                 keep_open=False):
+        self.nodes = simmap.nodes
+        self.move_cost = move_cost
+        self.keep_open = keep_open  # door policy of the steps, as in RouteGraph
+        self.rooms = RoomGraph(simmap, cross_cost, open_cost)
+        self.table = RouteTable(self.rooms)
+        self.door_at = {}  # (p, q) -> door between the two points
+        self.door_sides = {}  # door -> {room: point of the door in the room}
+        for d in simmap.doors:
+            p, q = simmap.doors[d][0], simmap.doors[d][1]
+            self.door_at[(p, q)] = d
+            self.door_at[(q, p)] = d
+            self.door_sides[d] = {simmap.nodes[p]: p, simmap.nodes[q]: q}
+
+    # Refines a route over rooms into points, and returns its cost
+    def refine(self, start, goal, rooms, doors):
+        points = [start]
+        cost = 0
+        for r1, r2 in zip(rooms, rooms[1:]):
+            p = points[-1]
+            best = None
+            for d in self.rooms.doors_between[(r1, r2)]:
+                side = self.door_sides[d][r1]
+                c = self.rooms.door_cost(d, doors) + (0 if side == p else self.move_cost)
+                if best is None or c < best[0]:
+                    best = (c, side, self.door_sides[d][r2])
+            c, side, other = best
+            if side != p:
+                points.append(side)
+            points.append(other)
+            cost += c
+        if points[-1] != goal:
+            points.append(goal)
+            cost += self.move_cost
+        return points, cost
+
+    def route(self, start, goal, doors):
+        """
+        Finds a route between two points through the cheapest route over the rooms
+        :param start: starting point
+        :param goal: point to reach
+        :param doors: status of the doors, as in navigate.State().doors
+        :return: the list of points from start to goal, or None if goal is unreachable
+        """
+        rooms = self.table.route(self.nodes[start], self.nodes[goal], doors)
+        if rooms is None:
+            return None
+        return self.refine(start, goal, rooms, doors)[0]
+
+    def distance(self, start, goal, doors):
+        """
+        Cost of the route between two points
+        :return: the cost, or None if goal is unreachable
+        """
+        rooms = self.table.route(self.nodes[start], self.nodes[goal], doors)
+        if rooms is None:
+            return None
+        return self.refine(start, goal, rooms, doors)[1]
+
+    # Expands a route into primitive steps, as RouteGraph.steps does
+    steps = RouteGraph.steps
+
+
+# *************************************************
+# Next-hop table of the cheapest routes of a RouteGraph or RoomGraph.
+# - The shortest path tree towards a goal is computed on the first
+#       request and kept: a route is then read in O(path length).
+# - The table follows the door statuses it is queried with: when a
+#       door changes, only the trees whose routes can change are dropped.
+# *************************************************
+class RouteTable:
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.doors = {}  # door statuses the trees were computed for
+        self.trees = {}  # goal -> (distance to goal, next hop towards goal)
+        self.bits = None  # open doors bitset of the statuses, when synced with a packed.DoorBits
+
+    def sync(self, doors):
+        """
+        Updates the table to the given door statuses
+        :param doors: status of the doors, as in navigate.State().doors
+        """
+        bits = getattr(doors, 'open_bits', None)
+        if bits is not None and bits == self.bits:
+            return
+        for d in self.graph.door_arcs:
+            old = self.doors.get(d)
+            new = doors[d] == 'open'
+            if old is None:
+                self.doors[d] = 'open' if new else 'closed'
+            elif (old == 'open') != new:
+                self.invalidate(d, 'open' if new else 'closed')
+        self.bits = bits
+
+    def invalidate(self, d, status):
+        """
+        Changes the status of a door, dropping the trees it affects
+        :param d: a door
+        :param status: the new status of the door
+        """
+        self.bits = None
+        u, v = self.graph.door_arcs[d]
+        before = self.graph.arc_cost(u, v, self.doors)
+        self.doors[d] = status
+        after = self.graph.arc_cost(u, v, self.doors)
+        for goal in list(self.trees):
+            dist, hop = self.trees[goal]
+            if after > before:
+                # the arc got more expensive: only routes through it change
+                stale = hop.get(u) == v or hop.get(v) == u
+            else:
+                # the arc got cheaper: routes change if it is now a shortcut
+                du = dist.get(u)
+                dv = dist.get(v)
+                stale = (dv is not None and (du is None or dv + after < du)) or \
+                        (du is not None and (dv is None or du + after < dv))
+            if stale:
+                del self.trees[goal]
+
+    # Computes the shortest path tree towards a goal
+    def tree(self, goal):
+        if goal in self.trees:
+            return self.trees[goal]
+        dist = {goal: 0}
+        hop = {}
+        expanded = set()
+        queue = [(0, goal)]
+        while queue:
+            c, v = heapq.heappop(queue)
+            if c > dist[v]:
+                continue
+            # arc costs are symmetric, so the tree is searched from the goal
+            for u, ac in self.graph.successors(v, self.doors, expanded):
+                nc = c + ac
+                if nc < dist.get(u, nc + 1):
+                    dist[u] = nc
+                    hop[u] = v
+                    heapq.heappush(queue, (nc, u))
+        self.trees[goal] = (dist, hop)
+        return self.trees[goal]
+
+    def route(self, start, goal, doors):
+        """
+        Finds the cheapest route between two nodes
+        :param start: starting node
+        :param goal: node to reach
+        :param doors: status of the doors, as in navigate.State().doors
+        :return: the list of nodes from start to goal, or None if goal is unreachable
+        """
+        self.sync(doors)
+        dist, hop = self.tree(goal)
+        if start not in dist:
+            return None
+        route = [start]
+        while route[-1] != goal:
+            route.append(hop[route[-1]])
+        return route
+
+    def distance(self, start, goal, doors):
+        """
+        Cost of the cheapest route between two nodes
+        :return: the cost, or None if goal is unreachable
+        """
+        self.sync(doors)
+        return self.tree(goal)[0].get(start)
@@ -0,0 +1,176 @@
+from collections.abc import MutableMapping, MutableSequence
+
+# *************************************************
+# Copy-on-write containers for the planning states.
+# - A copy shares the data of the original: copying is O(1),
+#       and the first write to either of them pays for
+#       separating the changed part only.
+# - PersistentDict keeps a read-only base dict and a small dict
+#       of changes on top of it; the changes are merged into a new
+#       base when they grow past a fraction of the base.
+# - The values must be immutable (strings, numbers, tuples, None),
+#       as they are shared between the copies.
+# *************************************************
+
+MERGE_SIZE = 8  # changes kept on top of the base before merging them
+
+_MISSING = object()
+_DELETED = object()
+
+
+class PersistentDict(MutableMapping):
+    __slots__ = ('_base', '_changes', '_owned', '_size', '_key')
+
+    def __init__(self, items=()):
+        self._base = dict(items)
+        self._changes = {}
+        self._owned = True  # False while _changes is shared with a copy
+        self._size = len(self._base)
+        self._key = None  # frozenset of the items, computed on demand
+
+    def __getitem__(self, key):
+        value = self._changes.get(key, _MISSING)
+        if value is _MISSING:
+            return self._base[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._size += 1
+        self._write(key, value)
+
+    def __delitem__(self, key):
+        self[key]  # raises KeyError if missing
+        self._size -= 1
+        self._write(key, _DELETED)
+
+    # Records a change, merging the changes when they grow too many
+    def _write(self, key, value):
+        self._key = None
+        if not self._owned:
+            self._changes = dict(self._changes)
+            self._owned = True
+        self._changes[key] = value
+        if len(self._changes) > max(MERGE_SIZE, len(self._base) // 8):
+            self._merge()
+
+    def __contains__(self, key):
+        value = self._changes.get(key, _MISSING)
+        if value is _MISSING:
+            return key in self._base
+        return value is not _DELETED
+
+    def __iter__(self):
+        changes = self._changes
+        for key in self._base:
+            if changes.get(key) is not _DELETED:
+                yield key
+        for key, value in changes.items():
+            if value is not _DELETED and key not in self._base:
+                yield key
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    # Merges the changes into a new base
+    def _merge(self):
+        base = dict(self._base)
+        for key, value in self._changes.items():
+            if value is _DELETED:
+                base.pop(key, None)
+            else:
+                base[key] = value
+        self._base = base
+        self._changes = {}
+        self._owned = True
+
+    def copy(self):
+        new = PersistentDict.__new__(PersistentDict)
+        new._base = self._base
+        new._changes = self._changes
+        new._owned = False
+        new._size = self._size
+        new._key = self._key
+        self._owned = False
+        return new
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def key(self):
+        """
+        :return: a hashable summary of the items, computed once and shared by the copies until written
+        """
+        if self._key is None:
+            self._key = frozenset(self.items())
+        return self._key
+
+    def __reduce__(self):
+        return (PersistentDict, (dict(self.items()),))
+
+
+class PersistentList(MutableSequence):
+    __slots__ = ('_items', '_owned')
+
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._owned = True  # False while _items is shared with a copy
+
+    def _own(self):
+        if not self._owned:
+            self._items = list(self._items)
+            self._owned = True
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __setitem__(self, i, value):
+        self._own()
+        self._items[i] = value
+
+    def __delitem__(self, i):
+        self._own()
+        del self._items[i]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, value):
+        return value in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, PersistentList)):
+            return self._items == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self._items)
+
+    def insert(self, i, value):
+        self._own()
+        self._items.insert(i, value)
+
+    def append(self, value):
+        self._own()
+        self._items.append(value)
+
+    def copy(self):
+        new = PersistentList.__new__(PersistentList)
+        new._items = self._items
+        new._owned = False
+        self._owned = False
+        return new
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return (PersistentList, (list(self._items),))
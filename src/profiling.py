@@ -0,0 +1,207 @@
+import time
+import functools
+import pyhop
+
+# *************************************************
+# Profiling of the HTN planner.
+# - install() wraps pyhop.seek_plan and the methods and operators
+#       declared in pyhop; uninstall() puts the originals back, so a
+#       planner without a profile runs exactly as before.
+# - For each task and method: the expansions (calls of the method),
+#       the failures (the method returned False), the backtracks (its
+#       subtasks led to no plan), the deepest expansion, the time
+#       spent in the method itself and the time spent with it on the
+#       decomposition stack.
+# - The decomposition stack (task:method frames, a frame ends when
+#       its subtasks are done) is sampled at each call and return of
+#       seek_plan, into a flamegraph-compatible folded trace.
+# *************************************************
+
+
+class MethodStats:
+    __slots__ = ('expansions', 'failures', 'backtracks', 'max_depth', 'eval')
+
+    def __init__(self):
+        self.expansions = 0
+        self.failures = 0
+        self.backtracks = 0
+        self.max_depth = 0
+        self.eval = 0.0  # seconds in the method itself
+
+
+class Profile:
+
+    def __init__(self):
+        self.methods = {}    # (task, method) -> MethodStats()
+        self.operators = {}  # operator -> MethodStats() (failures when it does not apply)
+        self.folded = {}     # 'frame;frame;task' -> seconds
+        self.max_depth = 0   # deepest call of seek_plan
+        self.stack = []      # (frame, number of tasks after it) of the decomposition
+        self.context = 'plan'
+        self.depth = 0
+        self.pending = None  # (frame, number of subtasks, (task, method)) of the last decomposition
+        self.last = None
+
+    # Adds the time since the last sample to the current stack
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.folded[self.context] = self.folded.get(self.context, 0.0) + now - self.last
+        self.last = now
+
+    def stats(self, task, method):
+        key = (task, method)
+        if key not in self.methods:
+            self.methods[key] = MethodStats()
+        return self.methods[key]
+
+    # Wraps seek_plan: keeps the decomposition stack and counts the backtracks
+    def wrap_seek(self, seek_plan):
+        @functools.wraps(seek_plan)
+        def wrapper(state, tasks, plan, depth, verbose=0):
+            if depth == 0:
+                self.last = None  # a new plan: the time between plans is not counted
+            self.tick()
+            saved = list(self.stack), self.context, self.depth
+            while self.stack and self.stack[-1][1] >= len(tasks):
+                self.stack.pop()
+            frame = self.pending
+            self.pending = None
+            if frame is not None and frame[1] > 0:
+                self.stack.append((frame[0], len(tasks) - frame[1]))
+            self.depth = depth
+            if depth > self.max_depth:
+                self.max_depth = depth
+            names = [f[0] for f in self.stack]
+            if tasks:
+                names.append(tasks[0][0])
+            self.context = ';'.join(['plan'] + names)
+            result = seek_plan(state, tasks, plan, depth, verbose)
+            self.tick()
+            if frame is not None and result is False:
+                self.methods[frame[2]].backtracks += 1
+            self.stack, self.context, self.depth = saved
+            return result
+        return wrapper
+
+    def wrap_method(self, task, method):
+        stats = self.stats(task, method.__name__)
+        frame = task + ':' + method.__name__
+
+        @functools.wraps(method)
+        def wrapper(state, *args):
+            stats.expansions += 1
+            if self.depth > stats.max_depth:
+                stats.max_depth = self.depth
+            start = time.perf_counter()
+            subtasks = method(state, *args)
+            stats.eval += time.perf_counter() - start
+            if subtasks is False:
+                stats.failures += 1
+            else:
+                self.pending = (frame, len(subtasks), (task, method.__name__))
+            return subtasks
+        return wrapper
+
+    def wrap_operator(self, operator):
+        stats = self.operators.setdefault(operator.__name__, MethodStats())
+
+        @functools.wraps(operator)
+        def wrapper(state, *args):
+            stats.expansions += 1
+            start = time.perf_counter()
+            result = operator(state, *args)
+            stats.eval += time.perf_counter() - start
+            if result is False:
+                stats.failures += 1
+            return result
+        return wrapper
+
+    # Inclusive time of each frame, from the folded trace
+    def frame_times(self):
+        times = {}
+        for key, secs in self.folded.items():
+            for frame in set(key.split(';')):
+                times[frame] = times.get(frame, 0.0) + secs
+        return times
+
+    def summary(self):
+        """
+        :return: a list of dicts, one per task and method, most expanded first
+        """
+        times = self.frame_times()
+        rows = []
+        for (task, method), s in self.methods.items():
+            rows.append({'task': task, 'method': method, 'expansions': s.expansions,
+                         'failures': s.failures, 'backtracks': s.backtracks,
+                         'max_depth': s.max_depth, 'eval': s.eval,
+                         'time': times.get(task + ':' + method, 0.0)})
+        for name, s in self.operators.items():
+            rows.append({'task': name, 'method': None, 'expansions': s.expansions,
+                         'failures': s.failures, 'backtracks': 0, 'max_depth': None,
+                         'eval': s.eval, 'time': s.eval})
+        rows.sort(key=lambda r: -r['expansions'])
+        return rows
+
+    def print(self):
+        print('-'.__mul__(100))
+        print('{:<14}{:<28}{:>10}{:>10}{:>12}{:>8}{:>14}{:>14}'.format(
+            'TASK:', 'METHOD:', 'EXPANDED:', 'FAILED:', 'BACKTRACKS:', 'DEPTH:', 'EVAL (ms):', 'TIME (ms):'))
+        for r in self.summary():
+            print('{:<14}{:<28}{:>10}{:>10}{:>12}{:>8}{:>14.3f}{:>14.3f}'.format(
+                r['task'], r['method'] or '(operator)', r['expansions'], r['failures'],
+                r['backtracks'], '' if r['max_depth'] is None else r['max_depth'], 1000 * r['eval'], 1000 * r['time']))
+        print('Max depth:', self.max_depth)
+        print('-'.__mul__(100))
+
+    def write_folded(self, path):
+        """
+        Writes the trace in the folded format of flamegraph.pl and speedscope:
+        one line per stack, with its time in microseconds
+        """
+        with open(path, 'w') as f:
+            for key, secs in sorted(self.folded.items()):
+                f.write('{} {}\n'.format(key, int(secs * 1e6)))
+
+
+_installed = None  # (profile, seek_plan, originals, wrapped) while installed
+
+
+def install(profile=None):
+    """
+    Starts profiling the planner: wraps the methods and operators declared so far
+    :param profile: the Profile() to add to, or None for a new one
+    :return: the Profile()
+    """
+    global _installed
+    if _installed is not None:
+        uninstall()
+    if profile is None:
+        profile = Profile()
+    originals = (dict(pyhop.methods), dict(pyhop.operators))
+    wrapped = ({task: [profile.wrap_method(task, m) for m in ms] for task, ms in pyhop.methods.items()},
+               {name: profile.wrap_operator(op) for name, op in pyhop.operators.items()})
+    _installed = (profile, pyhop.seek_plan, originals, wrapped)
+    pyhop.seek_plan = profile.wrap_seek(pyhop.seek_plan)
+    pyhop.methods.update(wrapped[0])
+    pyhop.operators.update(wrapped[1])
+    return profile
+
+
+def uninstall():
+    """
+    Stops profiling: puts the original methods and operators back, except
+    those declared again since install()
+    :return: the Profile(), or None if none was installed
+    """
+    global _installed
+    if _installed is None:
+        return None
+    profile, seek_plan, originals, wrapped = _installed
+    pyhop.seek_plan = seek_plan
+    for table, original, wrappers in zip((pyhop.methods, pyhop.operators), originals, wrapped):
+        for name, value in wrappers.items():
+            if table.get(name) is value:
+                table[name] = original[name]
+    _installed = None
+    return profile
@@ -0,0 +1,163 @@
+import bisect
+import pickle
+import random
+from contextlib import contextmanager
+import simulator
+import events
+from executor import compile_plan
+
+# *************************************************
+# Deterministic record and replay of the run of a robot.
+# - The recorder seeds the random generator of the map, takes the
+#       initial layout of the map, and subscribes to the event
+#       stream of the robot to capture every plan and every action.
+# - Every 'every' actions it takes a checkpoint: the boxes, the
+#       doors, the robot, the state of the random generator and the
+#       time, so a run is restored at any action from the checkpoint
+#       before it, without re-executing the prefix.
+# - Replay is headless (no GUI, no output) on a SimClock: only the
+#       actions are executed, none of the planning.
+# - The world of the robot must change only through its own actions
+#       and Map.reshuffle: a robot of a fleet cannot be replayed alone.
+# *************************************************
+
+# Fields of the 'action' events holding the arguments of each action
+ARGUMENTS = {'moveto': ('to',), 'cross': ('door', 'to'), 'open': ('door',),
+             'close': ('door',), 'pickup': ('box',), 'putdown': ('box',)}
+
+
+class Checkpoint:
+    __slots__ = ('index', 'boxes', 'doors', 'pos', 'carry', 'load', 'rng', 'time')
+
+    # The world and the robot before the action 'index'
+    def __init__(self, index, robot):
+        world = robot.map
+        self.index = index
+        self.boxes = dict(world.boxes)
+        self.doors = [world.doors[d][2] for d in world.door_names]
+        self.pos = robot.pos
+        self.carry = robot.carry
+        self.load = list(robot.load)
+        self.rng = world.rng.getstate()
+        self.time = robot.clock.now
+
+
+class Recording:
+
+    def __init__(self, seed, layout, robot, dynamic):
+        self.seed = seed
+        self.layout = layout    # the arguments of Map(), at the start
+        self.robot = robot      # name of the robot
+        self.capacity = 1       # capacity and max weight of the robot
+        self.max_weight = None
+        self.dynamic = dynamic  # value of simulator.DYNAMIC_WORLD
+        self.plans = []         # (index of the first action, plan)
+        self.actions = []       # actions executed, as in the plans
+        self.results = []       # True if the action succeeded
+        self.checkpoints = []   # Checkpoint(), by increasing index
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+class Recorder:
+
+    def __init__(self, robot, seed=0, every=100):
+        """
+        Starts recording the run of a robot
+        :param robot: a simulator.Robot(), its map gets a generator seeded with 'seed'
+        :param seed: seed of the changes of the world
+        :param every: number of actions between two checkpoints
+        """
+        robot.map.rng = random.Random(seed)
+        if robot.log is None:
+            robot.log = events.EventStream()
+        self.robot = robot
+        self.every = every
+        self.recording = Recording(seed, robot.map.layout(), robot.name, simulator.DYNAMIC_WORLD)
+        self.recording.capacity, self.recording.max_weight = robot.capacity, robot.max_weight
+        self.recording.checkpoints.append(Checkpoint(0, robot))
+        robot.log.subscribe(self)
+
+    def __call__(self, event):
+        rec = self.recording
+        kind = event['kind']
+        if kind == 'action' and event['robot'] == self.robot.name:
+            if event['status'] == 'done':
+                rec.results[-1] = True
+                return
+            # first event of an action: the world is as the previous actions left it
+            index = len(rec.actions)
+            if index - rec.checkpoints[-1].index >= self.every:
+                rec.checkpoints.append(Checkpoint(index, self.robot))
+            act = event['action']
+            rec.actions.append((act,) + tuple(event[f] for f in ARGUMENTS[act]))
+            rec.results.append(False)
+        elif kind in ('execute', 'segment') and event.get('status', 'start') == 'start':
+            rec.plans.append((len(rec.actions), list(event['plan'])))
+
+    # Stops recording, returns the Recording()
+    def stop(self):
+        self.robot.log.unsubscribe(self)
+        return self.recording
+
+
+# Runs without GUI, in the world (static or dynamic) of the recording
+@contextmanager
+def headless(recording):
+    saved = simulator.USE_GUI, simulator.DYNAMIC_WORLD
+    simulator.USE_GUI, simulator.DYNAMIC_WORLD = False, recording.dynamic
+    try:
+        yield
+    finally:
+        simulator.USE_GUI, simulator.DYNAMIC_WORLD = saved
+
+
+def restore(recording, index=0, log=None, model=None):
+    """
+    Rebuilds the world and the robot of a recording as they were before an action,
+    from the last checkpoint before it
+    :param recording: a Recording()
+    :param index: index of the action
+    :param log: the events.EventStream() of the robot, or None to run silently
+    :param model: the simulator.TimeModel() of the robot's SimClock
+    :return: the simulator.Robot(), to resume the run from there
+    """
+    k = bisect.bisect_right([cp.index for cp in recording.checkpoints], index) - 1
+    cp = recording.checkpoints[k]
+    layout = recording.layout
+    with headless(recording):
+        world = simulator.Map(rooms=layout['rooms'], nodes=layout['nodes'],
+                              doors=layout['doors'], boxes=cp.boxes, weights=layout.get('weights'))
+        for d, status in zip(world.door_names, cp.doors):
+            world.doors[d][2] = status
+        world.rng = random.Random()
+        world.rng.setstate(cp.rng)
+        robot = simulator.Robot(recording.robot, world, cp.pos,
+                                clock=simulator.SimClock(model, cp.time), log=log,
+                                capacity=recording.capacity, max_weight=recording.max_weight)
+        robot.carry = cp.carry
+        robot.load = list(cp.load)
+        if replay(recording, robot, cp.index, index) is not None:
+            raise ValueError("the recording does not replay from its checkpoint")
+    return robot
+
+
+def replay(recording, robot, start, stop=None):
+    """
+    Executes the actions of a recording on a robot restored before the action 'start'
+    :param stop: index of the action to stop before, None for the end of the run
+    :return: the index of the first action whose result differs from the recording, or None
+    """
+    actions = recording.actions[start:stop]
+    with headless(recording):
+        for i, (fun, args) in enumerate(compile_plan(actions, robot), start):
+            if fun(*args) != recording.results[i]:
+                return i
+    return None
@@ -0,0 +1,116 @@
+import time
+import threading
+
+# *************************************************
+# Rendering of the simulation.
+# - A Renderer receives the changes of the world: the robot moved to
+#       a point, a door opened or closed. NullRenderer ignores them
+#       (headless runs), DsimRenderer draws them with dsim.
+# - dsim is imported when a DsimRenderer starts, so headless runs
+#       never import it.
+# - DsimRenderer queues the changes and sends them to the window at
+#       most 'fps' times per second: on a thread of its own, or from
+#       the thread posting the changes when it is due. The robot moves
+#       are all sent, in order, so a robot is drawn along its path;
+#       changes of a door with no robot move between them are merged
+#       into the last one. The robot actions never wait for the window.
+# *************************************************
+
+
+class Renderer:
+
+    # Starts rendering the world of a simulator.Map
+    def start(self, simmap):
+        pass
+
+    # The robot moved to point p
+    def move_to(self, robot, p):
+        pass
+
+    # Door d is now 'open' or closed
+    def door(self, d, status):
+        pass
+
+    # Sends the pending changes to the window
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullRenderer(Renderer):
+    pass
+
+
+class DsimRenderer(Renderer):
+
+    def __init__(self, fps=30, threaded=False):
+        """
+        :param fps: number of frames sent to the window per second, at most
+        :param threaded: True to send them from a thread of the renderer, False from
+            the thread posting the changes (for toolkits bound to one thread)
+        """
+        self.period = 1.0 / fps
+        self.threaded = threaded
+        self.pending = []     # ('robot', name, point) and ('door', d, status) to send, in order
+        self.door_index = {}  # door -> index of its change in pending, while no move follows it
+        self.lock = threading.Lock()
+        self.last = 0.0
+        self.window = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, simmap):
+        import dsim
+        dsim.make_window()
+        self.window = (dsim.SimMap(), dsim.Robot())
+        for d in simmap.doors:
+            self.door(d, simmap.doors[d][2])
+        self.flush()
+        if self.threaded:
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+
+    def post(self, kind, name, value):
+        with self.lock:
+            if kind == 'robot':
+                self.door_index.clear()
+                self.pending.append((kind, name, value))
+            elif name in self.door_index:
+                self.pending[self.door_index[name]] = (kind, name, value)
+            else:
+                self.door_index[name] = len(self.pending)
+                self.pending.append((kind, name, value))
+        if not self.threaded and time.monotonic() - self.last >= self.period:
+            self.flush()
+
+    def move_to(self, robot, p):
+        self.post('robot', robot, p)
+
+    def door(self, d, status):
+        self.post('door', d, status)
+
+    def flush(self):
+        with self.lock:
+            changes, self.pending = self.pending, []
+            self.door_index = {}
+        self.last = time.monotonic()
+        if self.window is None:
+            return
+        robot = self.window[1]
+        for kind, name, value in changes:
+            if kind == 'robot':
+                robot.move_to(value)
+            else:
+                robot.open_door("open" if value == 'open' else "close", name)
+
+    def loop(self):
+        while not self.stopped.wait(self.period):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
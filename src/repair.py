@@ -0,0 +1,148 @@
+import copy
+import time
+import pyhop
+import events
+from navigate import read_state
+from executor import compile_plan
+
+# *************************************************
+# Execution with plan repair.
+# - The tasks are planned one after the other, each from the
+#       state expected at the end of the previous one, so the plan
+#       is a list of segments, one per task.
+# - Before each action its preconditions are checked on the world:
+#       when they do not hold (e.g. a box moved by Map.reshuffle)
+#       or the action fails, only the current task is replanned
+#       from the world; the actions already done and the segments
+#       of the next tasks are kept, re-derived from the state expected
+#       after the repaired one: a segment which no longer applies from
+#       it is replanned before running into the world.
+# - The number of repairs is bounded by a budget.
+# *************************************************
+
+
+# Returns True if the preconditions of an action hold in the world of the robot
+def applicable(act, robot):
+    world = robot.map
+    if act[0] == 'moveto':
+        return world.adjacent(robot.pos, act[1])
+    if act[0] == 'cross':
+        return world.doors[act[1]][2] == 'open' and world.adjacent(robot.pos, act[2])
+    if act[0] in ('open', 'close'):
+        return robot.pos in world.doors[act[1]][:2]
+    if act[0] == 'pickup':
+        return world.boxes[act[1]] == robot.pos
+    if act[0] == 'putdown':
+        return world.boxes[act[1]] == robot.name
+    return False
+
+
+# Returns the state expected after a plan, or False if an operator does not apply
+def progress(state, plan):
+    for act in plan:
+        state = pyhop.operators[act[0]](copy.deepcopy(state), *act[1:])
+        if state is False:
+            return False
+    return state
+
+
+class PlanRepair:
+
+    def __init__(self, robot, budget=10, verbose=1, stats=None):
+        """
+        :param robot: a simulator.Robot()
+        :param budget: number of repairs allowed
+        :param verbose: 0 silent, 1 publishes the plans and the repairs on the log of the robot
+        :param stats: an executor.ExecutionStats() collecting action latencies, or None
+        """
+        self.robot = robot
+        self.budget = budget
+        self.verbose = verbose
+        self.stats = stats
+        self.repairs = []  # (task, action) where the world diverged from the plan
+
+    # Publishes an event on the log of the robot, when verbose
+    def publish(self, kind, **fields):
+        if self.verbose > 0:
+            events.publish(self.robot.log, kind, **fields)
+
+    # Plans each task from the state expected after the previous ones
+    def plan(self, tasks):
+        state = read_state(self.robot)
+        segments = []
+        for task in tasks:
+            plan = pyhop.pyhop(state, [task], 0)
+            if plan is False:
+                return False
+            segments.append([task, plan])
+            state = progress(state, plan)
+        return segments
+
+    # Re-derives the segments after segment k from the state expected after it,
+    #       replanning those that do not apply any more. A segment without a plan
+    #       from the expected state is left to be repaired from the world.
+    def rebase(self, segments, k, state):
+        for segment in segments[k + 1:]:
+            after = progress(state, segment[1])
+            if after is False:
+                plan = pyhop.pyhop(state, [segment[0]], 0)
+                if plan is False:
+                    return
+                segment[1] = plan
+                after = progress(state, plan)
+            state = after
+
+    # Executes a segment, returns the index of the action where it diverged, or None
+    def execute(self, plan):
+        steps = compile_plan(plan, self.robot)
+        log = self.robot.log
+        if log is not None:
+            log.begin_plan()
+        try:
+            for i, (fun, args) in enumerate(steps):
+                if not applicable(plan[i], self.robot):
+                    return i
+                start = time.perf_counter()
+                result = fun(*args)
+                if self.stats is not None:
+                    self.stats.add(plan[i][0], time.perf_counter() - start)
+                if result is not True:
+                    return i
+            return None
+        finally:
+            if log is not None:
+                log.end_plan()
+
+    def run(self, tasks):
+        """
+        Plans and executes tasks, repairing the plan when the world diverges from it
+        :param tasks: a list of tasks in the HTN format
+        :return: True if the tasks are completed, False if the budget ran out,
+            None if no plan was found
+        """
+        segments = self.plan(tasks)
+        if segments is False:
+            self.publish('task', task=tasks, status='no plan')
+            return None
+        k = 0
+        while k < len(segments):
+            task, plan = segments[k]
+            self.publish('segment', task=task, plan=plan)
+            i = self.execute(plan)
+            if i is None:
+                k += 1
+                continue
+            self.repairs.append((task, plan[i]))
+            if len(self.repairs) > self.budget:
+                self.publish('repair', task=task, action=plan[i], status='exhausted')
+                return False
+            self.publish('repair', task=task, action=plan[i], status='diverged')
+            state = read_state(self.robot)
+            plan = pyhop.pyhop(state, [task], 0)
+            if plan is False:
+                self.publish('task', task=task, status='no plan')
+                return None
+            segments[k][1] = plan
+            self.rebase(segments, k, progress(state, plan))
+        self.publish('task', task=tasks, status='completed')
+        return True
@@ -0,0 +1,125 @@
+import pathplan
+
+# *************************************************
+# Ordering of a set of transport jobs (box, point) for one robot.
+# - The cost of an order is the route cost of the whole tour: from
+#       the robot to the first box, from each box to its point, and
+#       from each point to the next box. Route costs come from the
+#       path planning engine, door openings included.
+# - Small sets are ordered exactly (Held-Karp dynamic programming),
+#       larger ones by nearest neighbour improved with 2-opt.
+# *************************************************
+
+EXACT_SIZE = 10  # largest number of jobs ordered exactly
+
+INFINITY = float('inf')
+
+
+# Route costs of the jobs: from the start to each box, from each box to
+#       its point, and from the point of each job to the box of each other
+def job_costs(table, jobs, start, simmap, doors):
+    def dist(p, q):
+        d = table.distance(p, q, doors)
+        return INFINITY if d is None else d
+    sources = [simmap.boxes[box] for box, point in jobs]
+    first = [dist(start, s) for s in sources]
+    inner = [dist(s, point) for s, (box, point) in zip(sources, jobs)]
+    after = [[dist(point, s) for s in sources] for box, point in jobs]
+    return first, inner, after
+
+
+# Cost of visiting the jobs in the given order
+def tour_cost(order, first, inner, after):
+    if not order:
+        return 0
+    c = first[order[0]] + sum(inner[i] for i in order)
+    for i, j in zip(order, order[1:]):
+        c += after[i][j]
+    return c
+
+
+# Exact order by dynamic programming over the subsets of jobs
+def held_karp(first, after):
+    n = len(first)
+    best = {(1 << j, j): (first[j], None) for j in range(n)}
+    for mask in range(1, 1 << n):
+        for j in range(n):
+            if (mask, j) not in best:
+                continue
+            c = best[(mask, j)][0]
+            for k in range(n):
+                if mask & (1 << k):
+                    continue
+                key = (mask | (1 << k), k)
+                nc = c + after[j][k]
+                if key not in best or nc < best[key][0]:
+                    best[key] = (nc, j)
+    full = (1 << n) - 1
+    j = min(range(n), key=lambda j: best[(full, j)][0])
+    order = []
+    mask = full
+    while j is not None:
+        order.append(j)
+        prev = best[(mask, j)][1]
+        mask &= ~(1 << j)
+        j = prev
+    order.reverse()
+    return order
+
+
+# Greedy order: always the job whose box is the closest
+def nearest_neighbour(first, after):
+    left = set(range(len(first)))
+    order = [min(left, key=lambda j: first[j])]
+    left.remove(order[0])
+    while left:
+        i = order[-1]
+        order.append(min(left, key=lambda j: after[i][j]))
+        left.remove(order[-1])
+    return order
+
+
+# Improves an order by reversing segments while the tour gets cheaper
+def two_opt(order, first, inner, after):
+    best = tour_cost(order, first, inner, after)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 2, len(order) + 1):
+                candidate = order[:i] + order[i:j][::-1] + order[j:]
+                c = tour_cost(candidate, first, inner, after)
+                if c < best:
+                    order, best, improved = candidate, c, True
+    return order
+
+
+def order_jobs(simmap, jobs, start, table=None):
+    """
+    Orders transport jobs to minimise the route cost of the tour
+    :param simmap: a simulator.Map(), giving the boxes positions and the doors
+    :param jobs: a list of (box, point)
+    :param start: starting point of the robot
+    :param table: the pathplan.RouteTable() to read route costs from, or None for a new one
+    :return: the jobs, in the order to do them, without the boxes already at their point
+    """
+    jobs = [(box, point) for box, point in jobs if simmap.boxes[box] != point]
+    if not jobs:
+        return []
+    if table is None:
+        table = pathplan.RouteTable(pathplan.RouteGraph(simmap))
+    doors = {d: simmap.doors[d][2] for d in simmap.doors}
+    first, inner, after = job_costs(table, jobs, start, simmap, doors)
+    if len(jobs) <= EXACT_SIZE:
+        order = held_karp(first, after)
+    else:
+        order = two_opt(nearest_neighbour(first, after), first, inner, after)
+    return [jobs[i] for i in order]
+
+
+def transport_tasks(simmap, jobs, start, table=None):
+    """
+    Orders transport jobs into one list of tasks, to plan them at once
+    :return: a list of ('transport', box, point) tasks
+    """
+    return [('transport', box, point) for box, point in order_jobs(simmap, jobs, start, table)]
@@ -1,19 +1,50 @@
 import time
 import random
-import dsim
+from array import array
+from collections.abc import Mapping
+import events
+import render
 
-USE_GUI = True
+USE_GUI = True  # maps draw on a render.DsimRenderer by default, else on a NullRenderer
 DYNAMIC_WORLD = False
 
+# Duration in seconds of each robot action
+DURATIONS = {'moveto': 1.0, 'cross': 1.0, 'open': 1.0, 'close': 1.0,
+             'pickup': 1.0, 'putdown': 1.0}
 
-class GUI:
-    map = None
-    robot = None
 
-    def start(self):
-        dsim.make_window()
-        self.map = dsim.SimMap()
-        self.robot = dsim.Robot()
+# Default world: rooms with their objects, points with their room,
+#       doors with their two points and status, boxes with their point
+ROOMS = {'room1': ['Bed'], 'room2': ['Stove'], 'room3': ['Table']}
+NODES = {'p1': 'room1', 'p2': 'room1', 'p3': 'room1',
+        'p4': 'room2', 'p5': 'room2', 'p6': 'room2',
+        'p7': 'room3', 'p8': 'room3', 'p9': 'room3'}
+# change the status of the doors from 'open' to 'closed' to test your planner for task 1.4
+DOORS = {'door1': ['p2', 'p8', 'close'],
+        'door2': ['p6', 'p7', 'open'],
+        'door3': ['p3', 'p4', 'open']}
+BOXES = {'box1': 'p4', 'box2': 'p9', 'box3': 'p1'}
+
+
+# Groups the indices 0..len(keys)-1 by key (counting sort): the values
+#       of key k are index[start[k]:start[k+1]]
+def make_index(nkeys, keys, values):
+    start = array('i', bytes(4 * (nkeys + 1)))
+    for k in keys:
+        start[k + 1] += 1
+    for k in range(nkeys):
+        start[k + 1] += start[k]
+    index = array('i', bytes(4 * len(keys)))
+    fill = array('i', start)
+    for k, v in zip(keys, values):
+        index[fill[k]] = v
+        fill[k] += 1
+    return start, index
+
+
+# Names and index arrays of a Map, as make_graph builds them
+INDEX = ('room_names', 'point_names', 'door_names', 'point_room', 'door_points',
+         'room_start', 'room_points', 'door_start', 'point_doors')
 
 
 # *************************************************
@@ -21,178 +52,337 @@ class GUI:
 #       for defining the "map property of robot object".
 # - "rooms", "nodes", and "doors" should be compatible
 #       with variables in map.py.
+# - Each map owns its world: the default one is copied from
+#       ROOMS, NODES, DOORS and BOXES.
+# - Map.reshuffle draws from the map's own random generator "rng":
+#       the random module unless a seed is given, so a seeded map
+#       replays the same changes.
+# - make_graph interns the names of rooms, points and doors to
+#       integer ids and indexes the points of each room and the doors
+#       of each point, so "arcs" is a view computed from the indices.
+# - The changes the robots make are sent to the map's "renderer"
+#       (see render.py): the dsim window when USE_GUI, else nothing.
 # NOTE: the data-structure of variables in Map class are slightly
 #       different than variables in map.py (compare "rooms",
 #       "nodes", and "doors" in this class and map.py).
 # *************************************************
 class Map:
-    rooms = {'room1': ['Bed'], 'room2': ['Stove'], 'room3': ['Table']}
-    nodes = {'p1': 'room1', 'p2': 'room1', 'p3': 'room1',
-            'p4': 'room2', 'p5': 'room2', 'p6': 'room2',
-            'p7': 'room3', 'p8': 'room3', 'p9': 'room3'}
-    arcs = {}
-    # change the status of the doors from 'open' to 'closed' to test your planner for task 1.4
-    doors = {'door1': ['p2', 'p8', 'close'],
-            'door2': ['p6', 'p7', 'open'], 
-            'door3': ['p3', 'p4', 'open']}
-    boxes = {'box1': 'p4', 'box2': 'p9', 'box3': 'p1'}
-
-    def __init__(self):
-        self.make_graph()
-        self.gui = GUI()
-        if USE_GUI:
-            # threading.Thread(target=self.start_gui).start()
-            self.start_gui()
-            for d in self.doors:
-                if self.doors[d][2] == 'open':
-                    self.gui.robot.open_door("open", d)
-                else:
-                    self.gui.robot.open_door("close", d)
-
-    def start_gui(self):
-        self.gui.start()
-
-    def make_graph(self):
-        for p in self.nodes:
-            r = self.nodes[p]
-            if p not in self.arcs:
-                self.arcs[p] = []
-            for q in self.nodes:
-                if q != p and self.nodes[q] == r:
-                    self.arcs[p].append(q)
-            for d in self.doors:
-                if self.doors[d][0] == p:
-                    self.arcs[p].append(self.doors[d][1])
-                if self.doors[d][1] == p:
-                    self.arcs[p].append(self.doors[d][0])
-
-    def reshuffle(self, probability=0.5):
+    __slots__ = ('rooms', 'nodes', 'doors', 'boxes', 'weights', 'arcs', 'renderer', 'rng',
+                 'room_names', 'room_ids', 'point_names', 'point_ids',
+                 'door_names', 'door_ids', 'point_room', 'door_points',
+                 'room_start', 'room_points', 'door_start', 'point_doors', '__weakref__')
+
+    def __init__(self, rooms=None, nodes=None, doors=None, boxes=None, seed=None, index=None,
+                 renderer=None, weights=None):
+        rooms = ROOMS if rooms is None else rooms
+        doors = DOORS if doors is None else doors
+        self.rooms = {r: list(rooms[r]) for r in rooms}
+        self.nodes = dict(NODES if nodes is None else nodes)
+        self.doors = {d: list(doors[d]) for d in doors}
+        self.boxes = dict(BOXES if boxes is None else boxes)
+        self.weights = dict(weights) if weights else {}  # weights of the boxes, 1 if not given
+        self.rng = random if seed is None else random.Random(seed)
+        self.make_graph(index)
+        if renderer is None:
+            renderer = render.DsimRenderer() if USE_GUI else render.NullRenderer()
+        self.renderer = renderer
+        self.renderer.start(self)
+
+    # Returns a copy of the world of the map, as the arguments of Map()
+    def layout(self):
+        return {'rooms': {r: list(self.rooms[r]) for r in self.rooms},
+                'nodes': dict(self.nodes),
+                'doors': {d: list(self.doors[d]) for d in self.doors},
+                'boxes': dict(self.boxes),
+                'weights': dict(self.weights)}
+
+    # Builds the names and indices, or takes them from 'index' (a dict of
+    #       the names and arrays, e.g. the views of a map file, see mapfile.py)
+    def make_graph(self, index=None):
+        if index is not None:
+            for name in INDEX:
+                setattr(self, name, index[name])
+            self.room_ids = dict(zip(self.room_names, range(len(self.room_names))))
+            self.point_ids = dict(zip(self.point_names, range(len(self.point_names))))
+            self.door_ids = dict(zip(self.door_names, range(len(self.door_names))))
+            self.arcs = Arcs(self)
+            return
+        self.room_names = list(self.rooms)
+        self.room_ids = {r: i for i, r in enumerate(self.room_names)}
+        self.point_names = list(self.nodes)
+        self.point_ids = {p: i for i, p in enumerate(self.point_names)}
+        self.door_names = list(self.doors)
+        self.door_ids = {d: i for i, d in enumerate(self.door_names)}
+        room_ids = self.room_ids
+        self.point_room = array('i', [room_ids[r] for r in self.nodes.values()])
+        point_ids = self.point_ids
+        self.door_points = array('i')
+        for d in self.door_names:
+            self.door_points.append(point_ids[self.doors[d][0]])
+            self.door_points.append(point_ids[self.doors[d][1]])
+        npoints = len(self.point_names)
+        self.room_start, self.room_points = make_index(
+            len(self.room_names), self.point_room, range(npoints))
+        self.door_start, self.point_doors = make_index(
+            npoints, self.door_points, [i // 2 for i in range(len(self.door_points))])
+        self.arcs = Arcs(self)
+
+    # Returns the ids of the points adjacent to the point with id i
+    def neighbour_ids(self, i):
+        r = self.point_room[i]
+        ns = [j for j in self.room_points[self.room_start[r]:self.room_start[r + 1]] if j != i]
+        dp = self.door_points
+        for k in self.point_doors[self.door_start[i]:self.door_start[i + 1]]:
+            ns.append(dp[2 * k + 1] if dp[2 * k] == i else dp[2 * k])
+        return ns
+
+    # Returns True if the robot can go from point p to point q in one step
+    def adjacent(self, p, q):
+        i = self.point_ids.get(p)
+        j = self.point_ids.get(q)
+        if i is None or j is None or i == j:
+            return False
+        if self.point_room[i] == self.point_room[j]:
+            return True
+        dp = self.door_points
+        for k in self.point_doors[self.door_start[i]:self.door_start[i + 1]]:
+            if dp[2 * k] == j or dp[2 * k + 1] == j:
+                return True
+        return False
+
+    # Returns the points of room r
+    def points_of(self, r):
+        k = self.room_ids[r]
+        names = self.point_names
+        return [names[i] for i in self.room_points[self.room_start[k]:self.room_start[k + 1]]]
+
+    # Returns the doors of point p
+    def doors_of(self, p):
+        i = self.point_ids[p]
+        names = self.door_names
+        return [names[k] for k in self.point_doors[self.door_start[i]:self.door_start[i + 1]]]
+
+    def reshuffle(self, probability=0.5, log=events.default):
         """
         Changes things in the world at random. For now, only the position of boxes.
         :param probability: probability that a change will occur
+        :param log: the events.EventStream() reporting the changes, or None
         """
         for b in self.boxes:
-            if self.boxes[b] in self.nodes.keys():
-                if random.random() > probability:
+            if self.boxes[b] in self.nodes:
+                if self.rng.random() > probability:
                     oldpos = self.boxes[b]
-                    self.boxes[b] = random.choice(list(self.nodes.keys()))
-                    print("* Reshuffling:", b, "moved from",
-                          oldpos, "to", self.boxes[b])
+                    self.boxes[b] = self.rng.choice(self.point_names)
+                    if log is not None and log.enabled:
+                        log.publish('reshuffle', box=b, to=self.boxes[b], **{'from': oldpos})
+
+    # Publishes the rooms with their points, the doors and the boxes
+    def print(self, log=events.default):
+        if log is not None and log.enabled:
+            log.publish('map', rooms={r: self.points_of(r) for r in self.rooms},
+                        doors={d: self.doors[d][2] for d in self.doors},
+                        boxes=dict(self.boxes))
+
+
+# Read-only view of the arcs of a map: point -> list of adjacent points
+class Arcs(Mapping):
+    __slots__ = ('map',)
+
+    def __init__(self, simmap):
+        self.map = simmap
+
+    def __getitem__(self, p):
+        names = self.map.point_names
+        return [names[j] for j in self.map.neighbour_ids(self.map.point_ids[p])]
+
+    def __iter__(self):
+        return iter(self.map.point_names)
+
+    def __len__(self):
+        return len(self.map.point_names)
+
+# *************************************************
+# Time models of the robot actions.
+# - TimeModel gives the duration of an action: a fixed time per
+#       action type, plus a time per unit of arc length for
+#       moveto and cross when a distance function is given.
+# - RealTimeClock lets that time pass for real (interactive runs),
+#       SimClock only advances a simulated time (headless runs).
+# *************************************************
+class TimeModel:
+
+    def __init__(self, durations=None, distance=None, speed=1.0):
+        """
+        :param durations: durations of the actions, overriding DURATIONS
+        :param distance: a function (p, q) -> length of the arc from p to q, or None
+        :param speed: length travelled per second along the arcs
+        """
+        self.durations = dict(DURATIONS)
+        if durations is not None:
+            self.durations.update(durations)
+        self.distance = distance
+        self.speed = speed
+
+    # Returns the duration of an action, from point frm to point to for the moves
+    def duration(self, action, frm=None, to=None):
+        t = self.durations[action]
+        if self.distance is not None and to is not None:
+            t += self.distance(frm, to) / self.speed
+        return t
+
+
+class RealTimeClock:
+
+    # Shows the actions as a visual delay of 'delay' dots, 'step' seconds each
+    def __init__(self, model=None, delay=5, step=0.2):
+        self.model = model if model is not None else TimeModel()
+        self.delay = delay
+        self.step = step
+        self.start = time.time()
+
+    @property
+    def now(self):
+        return time.time() - self.start
+
+    # Calls tick() at each dot, if given
+    def wait(self, action, frm=None, to=None, tick=None):
+        for i in range(self.delay):
+            if tick is not None:
+                tick()
+            time.sleep(self.step)
+
+
+class SimClock:
+
+    def __init__(self, model=None, now=0.0):
+        self.model = model if model is not None else TimeModel()
+        self.now = now
+
+    def wait(self, action, frm=None, to=None, tick=None):
+        self.now += self.model.duration(action, frm, to)
 
-    def print(self):
-        print('-'.__mul__(30))
-        print('{:<10}{}'.format('ROOM:', 'POINTS:'))
-        for r in self.rooms:
-            ps = []
-            for p in self.nodes.keys():
-                if self.nodes[p] == r:
-                    ps.append(p)
-            print('{:<10}'.format(r) + ', '.join([p for p in ps]))
-        print('-'.__mul__(30))
-        print('{:<10}{}'.format('DOOR:', 'STATUS:'))
-        for d in self.doors:
-            print('{:<10}'.format(d) + self.doors[d][2])
-        print('-'.__mul__(30))
-        print('{:<10}{}'.format('BOX:', 'LOCATION:'))
-        for b in self.boxes:
-            print('{:<10}'.format(b) + self.boxes[b])
-        print('-'.__mul__(30))
 
 # *************************************************
 # Class Map includes the attributes and functions
 #       for defining a robot instance/object.
 # Note: an argument of the initialisation function is a "map object"
 #       that is an instance of the Map class.
+# - Actions take time on the robot's clock: a RealTimeClock by
+#       default, a SimClock to run headless and fast-forward.
+# - Actions are reported as 'action' events on the 'log' stream:
+#       events.default (the console) by default, None to run silently.
 # *************************************************
 
 
 class Robot:
 
     # Initializes the Robot instance with a name, map, and an optional starting position.
-    def __init__(self, name, simmap, start='p1'):
+    def __init__(self, name, simmap, start='p1', clock=None, log=events.default,
+                 capacity=1, max_weight=None):
         self.name = name
         self.map = simmap
         self.pos = start
-        self.carry = None
+        self.carry = None      # the box picked up last and still carried
+        self.load = []         # the boxes carried
+        self.capacity = capacity      # number of boxes the robot can carry
+        self.max_weight = max_weight  # total weight it can carry, None for no limit
+        self.clock = clock if clock is not None else RealTimeClock()
+        self.log = log
         # self.drobot = dsim.Robot()
 
-    # Creates a visual delay in the output to simulate suspense during operations
-    def suspence(self, delay=5):
-        for i in range(delay):
-            print('.', end='', flush=True)
-            time.sleep(0.2)
-        print(" done")
+    # Reports an event of an action: status is 'start', 'done' or 'failed'
+    def emit(self, action, status, **fields):
+        if self.log is not None and self.log.enabled:
+            self.log.publish('action', action=action, status=status, robot=self.name,
+                             time=self.clock.now, **fields)
+
+    # Reports the progress of an action, as the clock lets its time pass
+    def tick(self, action):
+        if self.log is not None and self.log.enabled:
+            self.log.publish('progress', action=action, robot=self.name)
+
+    # Lets the time of an action pass on the robot's clock
+    def suspence(self, action, frm=None, to=None):
+        self.clock.wait(action, frm, to, lambda: self.tick(action))
+        self.emit(action, 'done')
 
     # Moves the robot to a new location if possible
     def moveto(self, newloc):
-        if newloc in self.map.arcs[self.pos]:
-            print("Moving from", self.pos, "to", newloc, end='')
-            if USE_GUI:
-                self.map.gui.robot.move_to(newloc)
-            self.suspence()
+        if self.map.adjacent(self.pos, newloc):
+            self.emit('moveto', 'start', **{'from': self.pos, 'to': newloc})
+            self.map.renderer.move_to(self.name, newloc)
+            self.suspence('moveto', self.pos, newloc)
             if DYNAMIC_WORLD:
-                self.map.reshuffle()
+                self.map.reshuffle(log=self.log)
             self.pos = newloc
             return True
         else:
-            print("Cannot move from", self.pos, "to", newloc)
+            self.emit('moveto', 'failed', **{'from': self.pos, 'to': newloc})
             return False
 
 
     # Crosses a specified door to a new location if possible
     def cross(self, door, newloc):
-        if newloc in self.map.arcs[self.pos]:
-            print("Crossing", door, "from", self.pos, "to", newloc, end='')
-            if USE_GUI:
-                self.map.gui.robot.move_to(newloc)
-            self.suspence()
+        if self.map.adjacent(self.pos, newloc):
+            self.emit('cross', 'start', door=door, **{'from': self.pos, 'to': newloc})
+            self.map.renderer.move_to(self.name, newloc)
+            self.suspence('cross', self.pos, newloc)
             self.pos = newloc
             return True
         else:
-            print("Cannot cross", door, "from", self.pos, "to", newloc)
+            self.emit('cross', 'failed', door=door, **{'from': self.pos, 'to': newloc})
             return False
 
     # Opens a door
     def open(self, door):
-        print("Opening", door, end='')
-        if USE_GUI:
-            self.map.gui.robot.open_door("open", door)
-        self.suspence()
+        self.emit('open', 'start', door=door)
+        self.map.renderer.door(door, 'open')
+        self.suspence('open')
         self.map.doors[door][2] = 'open'
         return True
 
     # Closes a door
     def close(self, door):
-        print("Closing", door, end='')
-        if USE_GUI:
-            self.map.gui.robot.open_door("close", door)
-        self.suspence()
+        self.emit('close', 'start', door=door)
+        self.map.renderer.door(door, 'closed')
+        self.suspence('close')
         self.map.doors[door][2] = 'closed'
         return True
 
-    # Picks up a specified box if it is at the robot's current location
+    # Returns True if the robot has room for one more box
+    def fits(self, box):
+        if len(self.load) >= self.capacity:
+            return False
+        if self.max_weight is None:
+            return True
+        weights = self.map.weights
+        return sum(weights.get(b, 1) for b in self.load) + weights.get(box, 1) <= self.max_weight
+
+    # Picks up a specified box if it is at the robot's current location and the robot has room for it
     def pickup(self, box):
-        if self.pos == self.map.boxes[box]:
-            print("Picking up", box, end='')
-            self.suspence()
+        if self.pos == self.map.boxes[box] and self.fits(box):
+            self.emit('pickup', 'start', box=box)
+            self.suspence('pickup')
             self.carry = box
+            self.load.append(box)
             self.map.boxes[box] = self.name
             return True
         else:
-            print("Cannot pick up", box)
+            self.emit('pickup', 'failed', box=box)
             return False
 
 
     # Puts down a box that the robot is carrying
     def putdown(self, box):
-        if self.map.boxes[box] == self.name:
-            print("Putting down", box, end='')
-            self.suspence()
-            self.carry = None
+        if self.map.boxes[box] == self.name and box in self.load:
+            self.emit('putdown', 'start', box=box)
+            self.suspence('putdown')
+            self.load.remove(box)
+            self.carry = self.load[-1] if self.load else None
             self.map.boxes[box] = self.pos
             return True
         else:
-            print("Cannot put down", box)
+            self.emit('putdown', 'failed', box=box)
             return False
 
     # Returns the room the robot is currently in
@@ -205,6 +395,6 @@ class Robot:
 
     # Prints the current status of the robot including location and what it's carrying
     def print(self):
-        print('-'.__mul__(30))
-        print("ROBOT:", self.name, "at", self.pos, "carrying", self.carry)
-        print('-'.__mul__(30))
+        if self.log is not None and self.log.enabled:
+            self.log.publish('robot', robot=self.name, pos=self.pos, carry=self.carry,
+                             load=list(self.load))
@@ -1,5 +1,9 @@
 import simulator
+import events
 from navigate import *
+from executor import execute, ExecutionStats
+
+stats = ExecutionStats()  # latency of the actions executed
 
 
 def get_state(state, robot):
@@ -8,52 +12,40 @@ def get_state(state, robot):
     :param state: a navigate.State()
     :param robot: a simulator.Robot()
     """
-    state.pos['me'] = robot.pos
-    state.carry = robot.carry
-    state.crossed = []
-    state.doors = {}
-    for d in robot.map.doors:
-        state.doors[d] = robot.map.doors[d][2]
-    for b in robot.map.boxes.keys():
-        state.pos[b] = robot.map.boxes[b]
-    print("Initial state updated:")
-    pyhop.print_state(state)
-
-
-def execute(plan, robot):
-    print("Executing plan", plan)
-    print("Robot's initial location:", robot.pos)
-    for act in plan:
-        fun = robot.name + '.' + act[0]
-        args = '(*act[1:])'
-        cmd = fun + args
-        if eval(cmd) is not True:
-            return False
-    print("Robot's final location:", robot.pos)
-    return True
-
-
-def sense_plan_act(robot, state, task, verbose=1):
+    read_state(robot, state)
+    publish_state(state, robot.log)
+
+
+def sense_plan_act(robot, state, task, verbose=1, planner=None):
     """
     Implements the sense-plan-act loop: read the world state, generate a plan, execute it
     :param robot: a robot
     :param state: an initial state, will be filled in by reading the world state from the simulator
     :param task: a task, passed to the HTN planner
     :param verbose: passed to pyhop to control level of verbosity
+    :param planner: an anytime.AnytimePlanner() to plan within its budget and improve the
+        plan during the execution, or None to plan with pyhop
     :return: True if task completed, False if failed, None if no plan found
     """
     get_state(state, robot)
-    plan = pyhop.pyhop(state, task, verbose)
-    if plan:
-        result = execute(plan, robot)
-        if result:
-            print("Execution completed!")
+    try:
+        if planner is not None:
+            plan = planner.start(state, task).wait()
+        else:
+            plan = pyhop.pyhop(state, task, verbose)
+        if plan:
+            if planner is not None:
+                result = planner.execute(robot, stats)
+            else:
+                result = execute(plan, robot, stats)
+            events.publish(robot.log, 'task', task=task, status='completed' if result else 'failed')
+            return result
         else:
-            print("Execution failed!")
-        return result
-    else:
-        print("No plan found!")
-    return None
+            events.publish(robot.log, 'task', task=task, status='no plan')
+        return None
+    finally:
+        if planner is not None:
+            planner.stop()  # no search left running on the route tables
 
 
 def top_level(robot, task, verbose=1):
@@ -72,11 +64,14 @@ def top_level(robot, task, verbose=1):
 
     if verbose > 0:
         robot.map.print()
+    if verbose > 1:
+        stats.print()
 
 
 
 my_map = simulator.Map()
 my_map.print()
+use_map(my_map)
 
 my_rob = simulator.Robot("my_rob", my_map, 'p1')
 my_rob.print()
@@ -92,5 +87,6 @@ top_level(my_rob, [('navigate_to', 'p9')], verbose=1)
 
 
 if simulator.USE_GUI:
+    my_map.renderer.flush()
     input("Enter <return> here to exit")
 
@@ -1,7 +1,13 @@
 import simulator
+import events
+import navigate
 from random import choice
-from csp import*
+from assignment import solve
+from schedule import transport_tasks
 from navigate import *
+from executor import execute, ExecutionStats
+
+stats = ExecutionStats()  # latency of the actions executed
 
 
 
@@ -9,16 +15,28 @@ colors = {'room1': 'blue', 'box1': 'blue',
         'room2': 'green', 'box2': 'green',
         'room3': 'red', 'box3': 'red'}
 
-def constraint(rooma, boxa, roomb, boxb):
-    """A constraint saying two neighboring variables must differ in value."""
-    return boxa != boxb and colors[rooma] != colors[boxa] and colors[roomb] != colors[boxb]
+def constraint(room, box):
+    """A constraint saying a box cannot go to the room of its color."""
+    return colors[room] != colors[box]
+
+# Point where the box assigned to each room is put down
+targets = {'room1': 'p1', 'room2': 'p5', 'room3': 'p9'}
+
+
+def rearrangement(simmap):
+    """
+    Assigns a different box to each room, minimising the total transport distance
+    :param simmap: a simulator.Map()
+    :return: a dict room -> box, or None if there is no solution
+    """
+    doors = {d: simmap.doors[d][2] for d in simmap.doors}
 
-variables = ['room1', 'room2', 'room3']
-domains = {'room1':['box1', 'box2' , 'box3'] , 'room2':['box1', 'box2' , 'box3'], 'room3':['box1', 'box2' , 'box3']}
-neighbors = {'room1': ['room2' , 'room3'], 'room2' : ['room1', 'room3'], 'room3': ['room1', 'room2']}
-prob = CSP(variables, domains, neighbors, constraint)
+    def distance(room, box):
+        d = navigate.routes.distance(simmap.boxes[box], targets[room], doors)
+        return float('inf') if d is None else d
 
-arc = backtracking_search(prob)
+    domains = {r: list(simmap.boxes) for r in targets}
+    return solve(list(targets), domains, unary=constraint, all_different=True, cost=distance)
 
 def get_state(state, robot):
     """
@@ -26,51 +44,40 @@ def get_state(state, robot):
     :param state: a navigate.State()
     :param robot: a simulator.Robot()
     """
-    state.pos['me'] = robot.pos
-    state.carry = robot.carry
-    state.crossed = []
-    for d in robot.map.doors:
-        state.doors[d] = robot.map.doors[d][2]
-    for b in robot.map.boxes.keys():
-        state.pos[b] = robot.map.boxes[b]
-    print("Initial state updated:")
-    pyhop.print_state(state)
-
-
-def execute(plan, robot):
-    print("Executing plan", plan)
-    print("Robot's initial location:", robot.pos)
-    for act in plan:
-        fun = robot.name + '.' + act[0]
-        args = '(*act[1:])'
-        cmd = fun + args
-        if eval(cmd) is not True:
-            return False
-    print("Robot's final location:", robot.pos)
-    return True
+    read_state(robot, state)
+    publish_state(state, robot.log)
 
 
-def sense_plan_act(robot, state, task, verbose=1):
+def sense_plan_act(robot, state, task, verbose=1, planner=None):
     """
     Implements the sense-plan-act loop: read the world state, generate a plan, execute it
     :param robot: a robot
     :param state: an initial state, will be filled in by reading the world state from the simulator
     :param task: a task, passed to the HTN planner
     :param verbose: passed to pyhop to control level of verbosity
+    :param planner: an anytime.AnytimePlanner() to plan within its budget and improve the
+        plan during the execution, or None to plan with pyhop
     :return: True if task completed, False if failed, None if no plan found
     """
     get_state(state, robot)
-    plan = pyhop.pyhop(state, task, verbose)
-    if plan:
-        result = execute(plan, robot)
-        if result:
-            print("Execution completed!")
+    try:
+        if planner is not None:
+            plan = planner.start(state, task).wait()
         else:
-            print("Execution failed!")
-        return result
-    else:
-        print("No plan found!")
-    return None
+            plan = pyhop.pyhop(state, task, verbose)
+        if plan:
+            if planner is not None:
+                result = planner.execute(robot, stats)
+            else:
+                result = execute(plan, robot, stats)
+            events.publish(robot.log, 'task', task=task, status='completed' if result else 'failed')
+            return result
+        else:
+            events.publish(robot.log, 'task', task=task, status='no plan')
+        return None
+    finally:
+        if planner is not None:
+            planner.stop()  # no search left running on the route tables
 
 
 
@@ -87,20 +94,19 @@ def top_level(robot, task, verbose=1):
     if verbose > 0:
         robot.print()
     if task == ['rearrange']:
-        for key, value in arc.items():
-            if key == 'room1':
-                top_level(my_rob, [('transport', value, 'p1')], verbose=1)
-            elif key == 'room2':
-                top_level(my_rob, [('transport', value, 'p5')], verbose=1)
-            elif key == 'room3':
-                top_level(my_rob, [('transport', value, 'p9')], verbose=1)
-            else:
-                return False
+        arc = rearrangement(robot.map)
+        if arc is None:
+            return False
+        jobs = [(box, targets[room]) for room, box in arc.items()]
+        tasks = transport_tasks(robot.map, jobs, robot.pos, navigate.routes)
+        sense_plan_act(robot, state, tasks, verbose=verbose)
 
     else:
         sense_plan_act(robot, state, task, verbose=verbose)
     if verbose > 0:
         robot.map.print()
+    if verbose > 1:
+        stats.print()
 
 
 # #################################################
@@ -108,6 +114,7 @@ def top_level(robot, task, verbose=1):
 # #################################################
 my_map = simulator.Map()
 my_map.print()
+use_map(my_map)
 
 my_rob = simulator.Robot("my_rob", my_map, 'p1')
 my_rob.print()
@@ -118,4 +125,5 @@ simulator.DYNAMIC_WORLD = False
 top_level(my_rob, ['rearrange'], verbose=1)
 
 if simulator.USE_GUI:
+    my_map.renderer.flush()
     input("Enter <return> here to exit")